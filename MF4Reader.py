@@ -1,183 +1,589 @@
 from asammdf import MDF
+from asammdf import Signal as MdfSignal
 from asammdf.mdf import MdfException
 from can.io.blf import BLFReader
 from dbcparser import Database, Message, Signal
 from pathlib import Path
 import matplotlib.pyplot as plt
 import matplotlib.ticker as tck
+from matplotlib.gridspec import GridSpec
 import argparse
-from numpy import isnan
+import numpy as np
 from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+import hashlib
+import os
+import json
+import shutil
+import tempfile
+import zipfile
+import struct
+import zlib
 
 
 class MF4Reader:
-    def __init__(self, log_folder: Path, dbc_folder: Path):
+    def __init__(self, log_folder: Path, dbc_folder: Path, lazy: bool = False, cache_size: int = 32,
+                 workers: int = 1, cache_dir: Path = None, storage_dir: Path = None):
+        """
+        :param log_folder: folder with MF4 and BLF log files
+        :param dbc_folder: folder with dbc files
+        :param lazy: only index MF4 files here, load message frames on demand
+        :param cache_size: max number of messages kept in memory in lazy mode
+        :param workers: number of processes parsing dbc and log files in parallel
+        :param cache_dir: folder of ingested log files and compiled dbc cache, None to disable
+        :param storage_dir: keep frames in memory mapped files in this folder instead of RAM
+        """
         self.can_channels = []
         self.database = None
-        self.figure = None
-        self._plot_idx = 1
-        self._plot_signal_list = []
+        self._plots: MF4Reader.PlotFigure | None = None
         self.msg_frames = []
-
-        # parse dbc files
-        for fp in dbc_folder.iterdir():
-            if fp.is_file() and fp.suffix.lower() == '.dbc':
-                if self.database is None:
-                    self.database = Database(fp)
+        self.unknown_ids: dict[int, int] = dict()
+        self.lazy = lazy
+        self.cache_size = cache_size
+        self._log_index = self.LogIndex() if lazy else None
+        self._msg_cache: OrderedDict[str, MF4Reader.MessageLog | MF4Reader.MessageLogPdu1] = OrderedDict()
+        self._storage = self.FrameStorage(storage_dir) if storage_dir is not None else None
+        self._dtc_index: MF4Reader.DtcIndex | None = None
+        # nominal bits of all raw frames per channel
+        self.bus_load = self.BusLoad()
+
+        # parse dbc files, merge into one database
+        dbc_files = [fp for fp in dbc_folder.iterdir() if fp.is_file() and fp.suffix.lower() == '.dbc']
+        self.database = Database.from_files(dbc_files, cache_dir / 'dbc' if cache_dir is not None else None,
+                                            workers=workers)
+
+        # get dispatch table of all messages
+        self._router = router = self.MessageRouter(self.database.messages, self._storage)
+
+        # 'global' T0 is the earliest file start
+        log_files = []
+        for fp in log_folder.iterdir():
+            if fp.is_file():
+                tl0 = self.log_start_time(fp)
+                if tl0 is not None:
+                    log_files.append((tl0, fp))
+        log_files.sort()
+        tg0 = log_files[0][0] if len(log_files) > 0 else 0.0
+
+        if lazy:
+            # log_f.bus_logging_map['CAN'] - dictionary with num of CAN? and inside {msg ID: group_id}
+            eager_files = []
+            for tl0, fp in log_files:
+                if fp.suffix.lower() == '.mf4':
+                    log_f = MDF(fp)
+                    self.can_channels.extend(log_f.bus_logging_map['CAN'].keys())
+                    self._log_index.add_file(fp, log_f, tl0 - tg0)
+                    log_f.close()
+                else:
+                    eager_files.append((tl0, fp))
+        else:
+            eager_files = log_files
+
+        if cache_dir is not None:
+            cache = self.IngestCache(cache_dir, self.database.source_hash)
+            uncached_files = []
+            for tl0, fp in eager_files:
+                ingested = cache.load(fp)
+                if ingested is None:
+                    uncached_files.append((tl0, fp))
                 else:
-                    # merge into one file
-                    self.database.merge(Database(fp))
+                    self.__add_ingested(router, ingested, tl0 - tg0)
+        else:
+            cache = None
+            uncached_files = eager_files
+
+        known_pgns = router.known_pgns()
+        if workers > 1 and len(uncached_files) > 1:
+            # parse files in separate processes, merge here
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                jobs = [pool.submit(self.ingest_log_file, fp, 0.0, known_pgns) for tl0, fp in uncached_files]
+                for job, (tl0, fp) in zip(jobs, uncached_files):
+                    ingested = job.result()
+                    if cache is not None:
+                        cache.save(fp, ingested)
+                    self.__add_ingested(router, ingested, tl0 - tg0)
+        elif cache is not None:
+            for tl0, fp in uncached_files:
+                ingested = self.ingest_log_file(fp, 0.0, known_pgns)
+                cache.save(fp, ingested)
+                self.__add_ingested(router, ingested, tl0 - tg0)
+        else:
+            for tl0, fp in uncached_files:
+                for b_pgn, b_da, b_sa, channel, t, data, data_len in self.read_log_file(fp, tl0 - tg0, self.can_channels,
+                                                                                        known_pgns, self.bus_load):
+                    msg_log = router.get(b_pgn, count=len(t))
+                    if msg_log is not None:
+                        self.__add_frames(msg_log, b_da, b_sa, channel, t, data, data_len)
 
-        # get list of all messages
-        msg_list = []
-        for dbc_msg in self.database.messages:
-            if Message.is_pdu1(dbc_msg.id):
-                msg_list.append(self.MessageLogPdu1(dbc_msg))
-            else:
-                msg_list.append(self.MessageLog(dbc_msg))
+        # filter empty messages
+        self.msg_frames = [x for x in router.msg_logs if not x.is_empty()]
+        for msg_log in self.msg_frames:
+            msg_log.finalize()
+        self.unknown_ids = router.unknown_ids
 
-        unknown_list = []
+        # who sends what to whom, and how often
+        self.topology = self.BusTopology()
+        self.bus_stats = self.BusStats()
+        for msg_log in self.msg_frames:
+            for b_da, b_sa, channel, frames in msg_log.buckets():
+                self.topology.add(msg_log.msg, b_da, b_sa, channel, len(frames))
+                self.bus_stats.add(msg_log.msg, msg_log.get_pgn(), b_da, b_sa, channel, frames)
+        self.bus_stats.finalize()
+        if lazy:
+            self._log_index.add_to_topology(self.topology, router)
 
-        tg0 = None
-        for fp in log_folder.iterdir():
-            if not fp.is_file():
-                continue
-            if fp.suffix.lower() == '.mf4':
-                log_f = MDF(fp)
-                if tg0 is None:
-                    # set 'global' T0
-                    tg0 = log_f.start_time.timestamp()
-                # log file specific T0
-                tl0 = log_f.start_time.timestamp()
-
-                for can_n in log_f.bus_logging_map['CAN'].keys():
-                    self.can_channels.append(can_n)
-
-                # iter over groups
-                for i in range(len(log_f.virtual_groups)):
-                    pnds_arr = log_f.get_group(i)
-                    if len(pnds_arr) == 0:
-                        # skip?
-                        continue
+    @staticmethod
+    def __add_frames(msg_log, da: int, sa: int, channel: int, t: np.ndarray, data: np.ndarray, data_len: np.ndarray):
+        if da < 0:
+            msg_log.add_frames(t, data, data_len, sa, channel)
+        else:
+            msg_log.add_frames(t, data, data_len, da, sa, channel)
+
+    def __add_ingested(self, router: 'MF4Reader.MessageRouter', ingested: tuple, t_offset: float):
+        """
+        adds result of ingest_log_file
+        """
+        can_channels, buckets, unknown_ids, channel_load = ingested
+        self.can_channels.extend(can_channels)
+        self.bus_load.merge(channel_load, t_offset)
+        for b_pgn, b_da, b_sa, channel, t, data, data_len in buckets:
+            self.__add_frames(router.get(b_pgn, count=len(t)), b_da, b_sa, channel, t + t_offset, data, data_len)
+        for pgn, count in unknown_ids.items():
+            router.unknown_ids[pgn] = router.unknown_ids.get(pgn, 0) + count
 
-                    log_len = pnds_arr.shape[0]
-                    data_bytes = pnds_arr['CAN_DataFrame.CAN_DataFrame.DataBytes'].values
-                    bus_channels = pnds_arr['CAN_DataFrame.CAN_DataFrame.BusChannel'].values
-                    msg_ids = pnds_arr['CAN_DataFrame.CAN_DataFrame.ID'].values
-                    log_timestamps = pnds_arr.axes[0].values
+    @staticmethod
+    def log_start_time(fp: Path) -> float | None:
+        """
+        :return: start timestamp of MF4 or BLF file, None for other files
+        """
+        if fp.suffix.lower() == '.mf4':
+            log_f = MDF(fp, process_bus_logging=False)
+            t0 = log_f.start_time.timestamp()
+            log_f.close()
+            return t0
+        elif fp.suffix.lower() == '.blf':
+            with BLFReader(fp) as log_f:
+                return log_f.start_timestamp
+        return None
 
-                    for idx in range(log_len):
-                        # time_stamp = __has_timestamp(log_timestamps[idx])
-                        # if time_stamp is None:
-                        #     time_stamp = MF4Reader.CanTimeStamp(log_timestamps[idx])
-                        #     self.timeline.append(time_stamp)
+    @staticmethod
+    def read_log_file(fp: Path, t_offset: float, can_channels: list = None, known_pgns: set = None,
+                      bus_load: 'MF4Reader.BusLoad' = None):
+        """
+        reads CAN frames of MF4 or BLF file, multi-packet messages are reassembled
+        :param fp: log file
+        :param t_offset: added to all timestamps, which are relative to the file start
+        :param can_channels: CAN channels of the file are appended here
+        :param known_pgns: PGNs of dbc messages, to restore priority of reassembled messages
+        :param bus_load: all raw frames are counted here, None to disable
+        :return: iterator of (pgn, da, sa, channel, timestamps, payload matrix, payload length) buckets
+        """
+        # transport sessions don't span files
+        tp = MF4Reader.TpReassembler(known_pgns)
+        if fp.suffix.lower() == '.mf4':
+            log_f = MDF(fp)
+            if can_channels is not None:
+                can_channels.extend(log_f.bus_logging_map['CAN'].keys())
+
+            # iter over groups
+            for i in MF4Reader.can_groups(log_f):
+                for bucket in MF4Reader.read_mf4_group(log_f, i, t_offset, bus_load=bus_load):
+                    tp.add(bucket)
+                    yield bucket
+            log_f.close()
+            # TP.CM and TP.DT frames may be stored in different groups
+            yield from tp.flush()
+        elif fp.suffix.lower() == '.blf':
+            yield from MF4Reader.BlfBlockReader(fp).buckets(t_offset, tp=tp, bus_load=bus_load)
 
-                        # skip missing data
-                        if isnan(msg_ids[idx]):
-                            continue
+    @staticmethod
+    def ingest_log_file(fp: Path, t_offset: float, known_pgns: set) -> tuple[list, list, dict[int, int], dict]:
+        """
+        process pool job: reads whole log file into compact buckets
+        :param known_pgns: only buckets of these PGNs are returned
+        :return: CAN channels, buckets of known PGNs, {unknown PGN: number of frames},
+            raw frame counts per channel, see MF4Reader.BusLoad.channels
+        """
+        can_channels = []
+        buckets = []
+        unknown_ids = dict()
+        bus_load = MF4Reader.BusLoad()
+        for bucket in MF4Reader.read_log_file(fp, t_offset, can_channels, known_pgns, bus_load):
+            if bucket[0] in known_pgns:
+                buckets.append(bucket)
+            else:
+                unknown_ids[bucket[0]] = unknown_ids.get(bucket[0], 0) + len(bucket[4])
+        return can_channels, buckets, unknown_ids, bus_load.channels
 
-                        # get message class
-                        msg_id, msg_sa = Message.get_pgn(int(msg_ids[idx]))
-                        if Message.is_pdu1(int(msg_ids[idx])):
-                            # zero DA
-                            msg_da = msg_id & 0xFF
-                            msg_id = msg_id & 0x1FFF00
-                        else:
-                            msg_da = None
+    @staticmethod
+    def can_groups(log_f: MDF) -> list[int]:
+        """
+        :return: indexes of channel groups with CAN frames
+        """
+        out = []
+        for i, group in enumerate(log_f.groups):
+            if any(ch.name == 'CAN_DataFrame.ID' for ch in group.channels):
+                out.append(i)
+        return out
 
-                        if msg_id in unknown_list:
-                            continue
+    @staticmethod
+    def read_mf4_group(log_f: MDF, group: int, t_offset: float, chunk_size: int = 1 << 20,
+                       bus_load: 'MF4Reader.BusLoad' = None):
+        """
+        reads CAN frames of MF4 channel group in chunks of records, so memory use doesn't depend
+        on the group size
+        :param log_f: opened MF4 file
+        :param group: channel group index
+        :param t_offset: added to all timestamps, which are relative to the file start
+        :param chunk_size: number of records read at once
+        :param bus_load: all raw frames are counted here, None to disable
+        :return: iterator of (pgn, da, sa, channel, timestamps, payload matrix, payload length) buckets
+        """
+        channel_names = [ch.name for ch in log_f.groups[group].channels]
+        columns = ['CAN_DataFrame.ID', 'CAN_DataFrame.BusChannel', 'CAN_DataFrame.DataBytes']
+        if 'CAN_DataFrame.DataLength' in channel_names:
+            columns.append('CAN_DataFrame.DataLength')
+
+        cycles = log_f.groups[group].channel_group.cycles_nr
+        for record_offset in range(0, cycles, chunk_size):
+            signals = log_f.select([(name, group, None) for name in columns], record_offset=record_offset,
+                                   record_count=chunk_size, raw=True)
+            msg_ids = signals[0].samples.astype(np.int64)
+            bus_channels = signals[1].samples.astype(np.int64)
+            data, data_len = MF4Reader.payload_matrix(signals[2].samples)
+            if len(signals) > 3:
+                data_len = np.minimum(signals[3].samples, data.shape[1]).astype(np.int64)
+            # timestamp
+            t = t_offset + signals[0].timestamps.astype(np.float64)
+
+            # skip missing data
+            if signals[0].invalidation_bits is not None:
+                valid = ~np.asarray(signals[0].invalidation_bits, dtype=bool)
+                msg_ids = msg_ids[valid]
+                bus_channels = bus_channels[valid]
+                data = data[valid]
+                data_len = data_len[valid]
+                t = t[valid]
+            del signals
+            if bus_load is not None:
+                bus_load.add(bus_channels, msg_ids, data_len, t)
+
+            # get message class, whole chunk at once
+            pgn, sa, da = MF4Reader.split_ids(msg_ids)
+
+            # one bucket per (PGN, DA, SA, channel)
+            for b_pgn, b_da, b_sa, channel, sel in MF4Reader.group_frames(pgn, da, sa, bus_channels):
+                yield b_pgn, b_da, b_sa, channel, t[sel], data[sel], data_len[sel]
+
+    def __load_message(self, msg_log_name: str, t_start: float = None, t_end: float = None):
+        """
+        lazy mode: loads frames of a single message from indexed MF4 groups
+        :param t_start, t_end: time range, groups outside of it are skipped and result is not cached
+        :return: message log or None
+        """
+        if msg_log_name in self._msg_cache:
+            self._msg_cache.move_to_end(msg_log_name)
+            return self._msg_cache[msg_log_name]
+        is_range = t_start is not None or t_end is not None
+
+        dbc_msg = self.database.get_message(msg_log_name)
+        if dbc_msg is None:
+            return None
+        if Message.is_pdu1(dbc_msg.id):
+            msg_log = self.MessageLogPdu1(dbc_msg, self._storage)
+        else:
+            msg_log = self.MessageLog(dbc_msg, self._storage)
+
+        # frames from eagerly read logs
+        for eager_log in self.msg_frames:
+            if eager_log.msg is dbc_msg:
+                for b_da, b_sa, channel, frames in eager_log.buckets():
+                    self.__add_frames(msg_log, b_da, b_sa, channel, frames.time, frames.data, frames.length)
+
+        # message may also come in transport protocol frames
+        groups = self._log_index.get_groups(msg_log.get_pgn())
+        tp_groups = self._log_index.get_tp_groups()
+        known_pgns = self._router.known_pgns()
+        for fp in list(groups.keys()) + [x for x in tp_groups.keys() if x not in groups]:
+            file_groups = sorted(set(groups.get(fp, [])) | set(tp_groups.get(fp, [])))
+            # bus logging map is not needed, groups are known from the index
+            log_f = MDF(fp, process_bus_logging=False)
+            tp = self.TpReassembler(known_pgns)
+            for group, t_offset in file_groups:
+                if is_range and not self._log_index.overlaps(fp, group, t_start, t_end):
+                    continue
+                for bucket in self.read_mf4_group(log_f, group, t_offset):
+                    tp.add(bucket)
+                    if bucket[0] == msg_log.get_pgn():
+                        self.__add_frames(msg_log, *bucket[1:])
+            log_f.close()
+            for b_pgn, b_da, b_sa, channel, t, data, data_len in tp.flush():
+                if b_pgn == msg_log.get_pgn():
+                    self.__add_frames(msg_log, b_da, b_sa, channel, t, data, data_len)
+
+        if msg_log.is_empty():
+            return None
+        msg_log.finalize()
+        if is_range:
+            # partial message
+            return msg_log
+
+        # keep cache bounded
+        self._msg_cache[msg_log_name] = msg_log
+        while len(self._msg_cache) > self.cache_size:
+            _, dropped = self._msg_cache.popitem(last=False)
+            dropped.release()
+        return msg_log
+
+    def close(self):
+        """
+        removes memory mapped frame storage
+        """
+        self.msg_frames = []
+        self._msg_cache.clear()
+        if self._storage is not None:
+            self._storage.close()
 
-                        # data
-                        data = list(data_bytes[idx])
-                        # data_tmp = data_bytes[idx]
-                        # data: int = 0
-                        # for d_idx in range(len(data_tmp)):
-                        #     data = data + (data_tmp[d_idx] * 2**(d_idx * 8))
-
-                        # channel
-                        channel = bus_channels[idx]
-
-                        # timestamp
-                        t = tl0 - tg0 + log_timestamps[idx]
-
-                        # append
-                        for msg_log in msg_list:
-                            if msg_log.get_pgn() == msg_id:
-                                if msg_da is None:
-                                    msg_log.add_frame(t, data, msg_sa, channel)
-                                else:
-                                    msg_log.add_frame(t, data, msg_da, msg_sa, channel)
-                                break
-                        else:
-                            # append unknown list
-                            unknown_list.append(msg_id)
-                log_f.close()
-
-                # log_f.bus_logging_map['CAN'] - dictionary with num of CAN? and inside {msg ID: group_id}
-            elif fp.suffix.lower() == '.blf':
-                log_f = BLFReader(fp)
-                if tg0 is None:
-                    # set 'global' T0
-                    tg0 = log_f.start_timestamp
-                # log file specific T0
-                # tl0 = log_f.start_timestamp
-
-                for msg in log_f:
-                    msg_sa = self.sa_from_id(msg.arbitration_id)
-                    msg_id = self.pgn_from_id(msg.arbitration_id, with_priority=True)
-                    if Message.is_pdu1(msg.arbitration_id):
-                        # zero DA
-                        msg_da = msg_id & 0xFF
-                        msg_id = msg_id & 0x1FFF00
-                    else:
-                        msg_da = None
-
-                    if msg_id in unknown_list:
-                        continue
+    @staticmethod
+    def split_ids(msg_ids: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        vectorized Message.get_pgn and Message.is_pdu1 over array of raw IDs
+        :param msg_ids: int64 array of raw message IDs
+        :return: PGN (DA zeroed for PDU1), SA, DA (-1 for PDU2)
+        """
+        # standard CAN, get as is
+        is_standard_can = (msg_ids & (1 << 31)) == 0
+        pgn = np.where(is_standard_can, msg_ids, (msg_ids >> 8) & 0x1FFFFF)
+        sa = np.where(is_standard_can, 0xFE, msg_ids & 0xFF)
+
+        is_pdu1 = ((msg_ids >> 16) & 0xFF) < 240
+        da = np.where(is_pdu1, pgn & 0xFF, -1)
+        pgn = np.where(is_pdu1, pgn & 0x1FFF00, pgn)
+        return pgn, sa, da
 
-                    channel = msg.channel
-                    # data
-                    data = list(msg.data)
-                    # timestamp
-                    t = msg.timestamp - tg0
-                    # append
-                    for msg_log in msg_list:
-                        if msg_log.get_pgn() == msg_id:
-                            if msg_da is None:
-                                msg_log.add_frame(t, data, msg_sa, channel)
-                            else:
-                                msg_log.add_frame(t, data, msg_da, msg_sa, channel)
-                            break
-                    else:
-                        # append unknown list
-                        unknown_list.append(msg_id)
+    @staticmethod
+    def group_frames(pgn: np.ndarray, da: np.ndarray, sa: np.ndarray, channel: np.ndarray):
+        """
+        groups frames by (PGN, DA, SA, channel). Frame order inside a group is preserved
+        :return: iterator of (pgn, da, sa, channel, frame indices)
+        """
+        if len(pgn) == 0:
+            return
+        # one sort key: 21 bit PGN, DA from -1, 8 bit SA, 16 bit channel from -1
+        key = ((pgn.astype(np.int64) << 34) | ((da.astype(np.int64) + 1) << 25) |
+               (sa.astype(np.int64) << 17) | (channel.astype(np.int64) + 1))
+        order = np.argsort(key, kind='stable')
+        key = key[order]
+        edges = np.flatnonzero(key[1:] != key[:-1]) + 1
+        starts = np.concatenate(([0], edges))
+        ends = np.concatenate((edges, [len(order)]))
+        first = order[starts]
+        groups = zip(pgn[first].tolist(), da[first].tolist(), sa[first].tolist(), channel[first].tolist(),
+                     starts.tolist(), ends.tolist())
+        for b_pgn, b_da, b_sa, b_channel, start, end in groups:
+            yield b_pgn, b_da, b_sa, b_channel, order[start:end]
 
-        # filter empty messages
-        self.msg_frames = [x for x in msg_list if not x.is_empty()]
+    @staticmethod
+    def payload_matrix_from_flat(flat: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """
+        scatters concatenated payloads into zero padded matrix
+        :param flat: uint8 array of all payloads
+        :param lengths: payload length of each frame
+        :return: N x max length uint8 matrix
+        """
+        width = int(lengths.max()) if len(lengths) > 0 else 8
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        cols = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        data = np.zeros((len(lengths), width), dtype=np.uint8)
+        data[rows, cols] = flat
+        return data
 
     @staticmethod
-    def sa_from_id(msg_id):
-        return msg_id & 0xFF
+    def payload_matrix(data_bytes: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        converts column of frame payloads into zero padded matrix
+        :param data_bytes: object array of uint8 arrays or 2D uint8 array
+        :return: N x width uint8 matrix, payload length of each frame
+        """
+        if len(data_bytes) == 0:
+            return np.zeros((0, 8), dtype=np.uint8), np.zeros(0, dtype=np.int64)
+        if data_bytes.dtype != object:
+            data = np.asarray(data_bytes, dtype=np.uint8).reshape(len(data_bytes), -1)
+            return data, np.full(len(data), data.shape[1], dtype=np.int64)
+
+        lengths = np.fromiter((len(x) for x in data_bytes), dtype=np.int64, count=len(data_bytes))
+        width = int(lengths.max())
+        if (lengths == width).all():
+            return np.stack(data_bytes).astype(np.uint8), lengths
+
+        # variable DLC, scatter into zero padded rows
+        flat = np.concatenate(data_bytes).astype(np.uint8)
+        return MF4Reader.payload_matrix_from_flat(flat, lengths), lengths
+
+    def get_unknown_ids(self) -> dict[int, int]:
+        """
+        :return: {PGN (DA zeroed for PDU1): number of frames} of all IDs missing in the dbc files
+        """
+        return dict(self.unknown_ids)
+
+    def __find_message(self, msg_name: str, t_start: float = None, t_end: float = None):
+        if self.lazy:
+            return self.__load_message(msg_name, t_start, t_end)
+        return next((x for x in self.msg_frames if x.msg.name == msg_name), None)
+
+    def get_message(self, msg_name: str, t_start: float = None, t_end: float = None,
+                    sa: int = None, da: int = None, channel: int = None) -> 'MF4Reader.TraceData | None':
+        """
+        Frames of one SA/DA/CAN variant of the message. Selectors left as None are asked for
+        if the message has several variants, see get_message_variants for the non-interactive query
+        :param msg_name: dbc message name
+        :param t_start: first timestamp of range, None for the trace start
+        :param t_end: last timestamp of range, None for the trace end
+        :param sa: source address
+        :param da: destination address, PDU1 messages only
+        :param channel: CAN channel
+        :return: time sorted frames of the message, views of stored frames
+        """
+        msg_log = self.__find_message(msg_name, t_start, t_end)
+        if msg_log is None:
+            return None
+        trace_data = msg_log.get_frame_trace(msg_name, self.TraceData(SA=sa, DA=da, CAN=channel))
+        if trace_data is None:
+            return None
+
+        if t_start is not None or t_end is not None:
+            trace_data.trace = self.time_slice(*trace_data.trace, t_start, t_end)
+        return trace_data
+
+    def get_message_variants(self, msg_name: str, t_start: float = None,
+                             t_end: float = None) -> list['MF4Reader.TraceData']:
+        """
+        All SA/DA/CAN variants of the message, never asks for input
+        :param msg_name: dbc message name
+        :param t_start: first timestamp of range, None for the trace start
+        :param t_end: last timestamp of range, None for the trace end
+        :return: time sorted frames of every variant, DA is None for PDU2 messages
+        """
+        msg_log = self.__find_message(msg_name, t_start, t_end)
+        if msg_log is None:
+            return []
+        variants = []
+        for da, sa, channel, frames in msg_log.buckets():
+            trace = self.time_slice(frames.time, frames.data, t_start, t_end)
+            variants.append(self.TraceData(trace, SA=sa, DA=da if da >= 0 else None, CAN=channel))
+        return variants
+
+    def decode_message(self, msg_name: str, sig_names: list[str] = None, t_start: float = None,
+                       t_end: float = None) -> list[tuple['MF4Reader.TraceData', np.ndarray]]:
+        """
+        Decode signals of all variants of the message, never asks for input
+        :param msg_name: dbc message name
+        :param sig_names: signals to decode, None for all signals of the message
+        :param t_start: first timestamp of range, None for the trace start
+        :param t_end: last timestamp of range, None for the trace end
+        :return: [(variant, record array with float64 field per signal)]
+        """
+        dbc_msg = self.database.get_message(msg_name)
+        if dbc_msg is None:
+            raise Exception(f'No such message: {msg_name}')
+        if sig_names is not None:
+            dbc_sigs = [dbc_msg.get_signal(name) for name in sig_names]
+            for name, sig in zip(sig_names, dbc_sigs):
+                if sig is None:
+                    raise Exception(f'No such signal: {msg_name}.{name}')
+
+        out = []
+        for trace_data in self.get_message_variants(msg_name, t_start, t_end):
+            frames = trace_data.trace[1]
+            if sig_names is None:
+                # all signals in one pass
+                values = dbc_msg.frames2data(frames)
+            else:
+                values = np.empty(len(frames), dtype=[(sig.name, np.float64) for sig in dbc_sigs])
+                for sig in dbc_sigs:
+                    values[sig.name] = sig.frames2data(frames)
+            out.append((trace_data, values))
+        return out
 
     @staticmethod
-    def pgn_from_id(msg_id, with_priority=False):
-        if with_priority:
-            return (msg_id >> 8) & 0x1FFFFF
-        else:
-            return (msg_id >> 8) & 0x3FFFF
+    def time_slice(time: np.ndarray, data: np.ndarray, t_start: float = None, t_end: float = None) -> tuple:
+        """
+        :param time: sorted timestamps
+        :return: (time, data) views of frames within [t_start, t_end]
+        """
+        start = 0 if t_start is None else np.searchsorted(time, t_start, side='left')
+        end = len(time) if t_end is None else np.searchsorted(time, t_end, side='right')
+        return time[start:end], data[start:end]
 
-    def get_message(self, msg_name: str) -> 'MF4Reader.TraceData | None':
-        for msg_log in self.msg_frames:
-            frame_trace = msg_log.get_frame_trace(msg_name)
-            if frame_trace is not None:
-                return frame_trace
-        else:
-            return None
+    @staticmethod
+    def decimate(time: np.ndarray, data: np.ndarray, t_start: float = None, t_end: float = None,
+                 buckets: int = 1000) -> tuple:
+        """
+        Min/max decimation, keeps first, last, min and max sample of every time bucket
+        so the drawn envelope matches the full trace
+        :param time: sorted timestamps
+        :param data: signal values
+        :param t_start: start of the visible range, None for the trace start
+        :param t_end: end of the visible range, None for the trace end
+        :param buckets: number of time buckets, usually the axes width in pixels
+        :return: (time, data) of the kept samples
+        """
+        n = len(time)
+        # keep one sample on each side of the range, so steps reach the axes edges
+        start = 0 if t_start is None else max(int(np.searchsorted(time, t_start, side='left')) - 1, 0)
+        end = n if t_end is None else min(int(np.searchsorted(time, t_end, side='right')) + 1, n)
+        time = time[start:end]
+        data = data[start:end]
+        n = len(time)
+        if n <= 4 * buckets:
+            return time, data
+
+        # bucket boundaries in samples
+        edges = np.linspace(time[0], time[-1], buckets + 1)
+        starts = np.unique(np.searchsorted(time, edges[:-1], side='left'))
+        starts = starts[starts < n]
+        counts = np.diff(np.append(starts, n))
+
+        # first sample index of the min and max value of each bucket, NaN is ignored
+        idx = np.arange(n)
+        y_min = np.repeat(np.fmin.reduceat(data, starts), counts)
+        y_max = np.repeat(np.fmax.reduceat(data, starts), counts)
+        i_min = np.minimum.reduceat(np.where(data == y_min, idx, n), starts)
+        i_max = np.minimum.reduceat(np.where(data == y_max, idx, n), starts)
+
+        keep = np.unique(np.concatenate((starts, starts + counts - 1, i_min, i_max)))
+        keep = keep[keep < n]
+        return time[keep], data[keep]
+
+    @staticmethod
+    def __plot_buckets(ax) -> int:
+        # one bucket per pixel column of the axes
+        return max(int(ax.bbox.width), 100)
+
+    @staticmethod
+    def __redecimate(ax, line, t, x, drawn: list):
+        # redraw from the full trace for the new x range
+        x_min, x_max = ax.get_xlim()
+        buckets = MF4Reader.__plot_buckets(ax)
+        # skip if the same samples are visible, e.g. autoscale of shared axes
+        key = (int(np.searchsorted(t, x_min)), int(np.searchsorted(t, x_max, side='right')), buckets)
+        if key == drawn[0]:
+            return
+        drawn[0] = key
+        t_draw, x_draw = MF4Reader.decimate(t, x, x_min, x_max, buckets)
+        # stale line is redrawn by the canvas, drawing here would recurse on shared axes
+        line.set_data(t_draw, x_draw)
 
     @staticmethod
     def __plot(ax, t, x, signal: Signal, title: str):
-        ax.step(t, x, 'o-', where='post')
+        # draw decimated trace, the full trace is kept for zoom and pan
+        buckets = MF4Reader.__plot_buckets(ax)
+        t_draw, x_draw = MF4Reader.decimate(t, x, buckets=buckets)
+        line, = ax.step(t_draw, x_draw, 'o-', where='post')
+        drawn = [(0, len(t), buckets)]
+        ax.callbacks.connect('xlim_changed', lambda a: MF4Reader.__redecimate(a, line, t, x, drawn))
         title = signal.name + title
         ax.set_title(title)
         ax.xaxis.set_minor_locator(tck.AutoMinorLocator())
@@ -203,16 +609,20 @@ class MF4Reader:
         elif signal.length == 1:
             ax.set_yticks([0, 1], labels=['False', 'True'])
 
-    def __clear_fig(self, *args):
-        self.figure = None
-        self._plot_idx = 1
-        self._plot_signal_list = []
+    @property
+    def figure(self):
+        return self._plots.figure if self._plots is not None else None
+
+    def __clear_fig(self, event):
+        # ignore late close events of an already replaced figure
+        if self._plots is not None and event.canvas.figure is self._plots.figure:
+            self._plots = None
 
     def remove_axes(self, index: int = None):
-        if self.figure is None:
+        if self._plots is None:
             # nothing to remove
             return
-        axes_range = len(self.figure.get_axes())
+        axes_range = len(self._plots)
         if axes_range == 0:
             # no axes in figure, just exit
             return
@@ -225,48 +635,22 @@ class MF4Reader:
 
         if axes_range == 1:
             # last axes, just close the figure
-            plt.close(self.figure)
+            plt.close(self._plots.figure)
+            self._plots = None
             return
 
-        # remove given axes
-        self._plot_idx -= 1
-        del self._plot_signal_list[index]
-        self.__refresh_plot(self._plot_idx-1)
-
-    def __refresh_plot(self, new_size):
-        if len(self.figure.axes) != new_size:
-            old_axes = self.figure.get_axes()
-            for i, ax in enumerate(old_axes):
-                old_axes[i] = [ax.lines[0].get_xdata(), ax.lines[0].get_ydata()]
-            self.figure.clear()
-            new_axes = self.figure.subplots(new_size, 1)
-            copy_range = min(len(old_axes), new_size)
-            for i in range(copy_range):
-                ax = old_axes[i]
-                self.__plot(self.figure.axes[i], ax[0], ax[1], self._plot_signal_list[i][0], self._plot_signal_list[i][1])
-            return new_axes
-        else:
-            return self.figure.axes
+        # remove given axes, the others stay as they are
+        self._plots.remove(index)
 
     def __append_figure(self, t, y, signal, title):
         # plot
         plt.ion()
-        if self.figure is None:
-            self.figure = plt.figure()
-            self.figure.canvas.mpl_connect('close_event', self.__clear_fig)
-            self._plot_idx = 1
-            new_axes = self.figure.subplots(1, 1)
-            self.__plot(new_axes, t, y, signal, title)
-            self._plot_signal_list = [(signal, title)]
-        else:
-            new_axes = self.__refresh_plot(self._plot_idx)
-            self.__plot(new_axes[self._plot_idx - 1], t, y, signal, title)
-            self._plot_signal_list.append((signal, title))
+        if self._plots is None:
+            self._plots = self.PlotFigure(self.__clear_fig)
+        self.__plot(self._plots.add(signal, title, t, y), t, y, signal, title)
         plt.show()
-        # increment num of plots
-        self._plot_idx += 1
 
-    def plot_signal(self, msg_name, sig_name=None):
+    def plot_signal(self, msg_name, sig_name=None, sa: int = None, da: int = None, channel: int = None):
         # get signal data
         try:
             dbc_msg = self.database.get_message(msg_name)
@@ -285,29 +669,88 @@ class MF4Reader:
                 dbc_sig = dbc_msg.signals
 
             # fetch all message frames
-            trace_data = self.get_message(msg_name)
+            trace_data = self.get_message(msg_name, sa=sa, da=da, channel=channel)
             if trace_data is None:
                 print(f'No {msg_name} message in the logs.')
                 return
 
+            # frames are sorted by time at ingest
+            T_data, frames = trace_data.trace
+
+            # decode
+            if sig_name is None:
+                # all signals in one pass
+                values = dbc_msg.frames2data(frames)
+            else:
+                values = {dbc_sig[0].name: dbc_sig[0].frames2data(frames)}
+
             # draw
             for sig in dbc_sig:
-                Y_data = []
-                T_data = []
-                # sort, just in case
-                trace_data.trace.sort(key=lambda x: x[0])
-                for msg_data in trace_data.trace:
-                    Y_data.append(sig.bytes2data(msg_data[1]))
-                    T_data.append(msg_data[0])
-
-                self.__append_figure(T_data, Y_data, sig, trace_data.to_title())
+                self.__append_figure(T_data, values[sig.name], sig, trace_data.to_title())
 
             plt.draw()
             plt.pause(0.1)
         except MdfException as ex:
             print(ex)
 
-    def plot_dtc(self, spn, fmi):
+    def export_signals(self, path: Path, fmt: str = 'mf4', msg_names: list[str] = None,
+                       chunk_size: int = 1 << 18, workers: int = None) -> int:
+        """
+        Decode all signals of every message variant and stream them into path in chunks of frames,
+        see MF4Reader.SignalExport for the formats
+        :param path: output file, folder for csv
+        :param fmt: csv, npz or mf4
+        :param msg_names: messages to export, None for all messages in the logs
+        :param chunk_size: frames decoded at once, memory use is about workers + 1 chunks
+        :param workers: number of threads decoding chunks, None for all cores
+        :return: number of exported message traces
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if msg_names is None:
+            msg_names = [x.name for x in self.database.messages]
+
+        out = self.SignalExport(path, fmt)
+        count = 0
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for msg_name in msg_names:
+                    dbc_msg = self.database.get_message(msg_name)
+                    if dbc_msg is None:
+                        raise Exception(f'No such message: {msg_name}')
+                    if len(dbc_msg.signals) == 0:
+                        continue
+                    sig_names = [x.name for x in dbc_msg.signals]
+
+                    for trace_data in self.get_message_variants(msg_name):
+                        time, frames = trace_data.trace
+                        if len(time) == 0:
+                            continue
+                        out.begin(self.SignalExport.trace_name(msg_name, trace_data), sig_names, len(time))
+                        # decode ahead in the pool, write in order
+                        pending = deque()
+                        for start in range(0, len(time), chunk_size):
+                            end = start + chunk_size
+                            pending.append((time[start:end], pool.submit(dbc_msg.frames2data, frames[start:end])))
+                            if len(pending) > workers:
+                                t, future = pending.popleft()
+                                out.write(t, future.result())
+                        while pending:
+                            t, future = pending.popleft()
+                            out.write(t, future.result())
+                        out.end()
+                        count += 1
+        finally:
+            out.close()
+        return count
+
+    def get_dtc_index(self) -> 'MF4Reader.DtcIndex | None':
+        """
+        :return: index of all DTCs in DM01 frames, built on first call. None if not available
+        """
+        if self._dtc_index is not None:
+            return self._dtc_index
+
         # find sig and msg
         dtc_active_msg = 'DM01'
         sig_PL = 'PLStatus'  # Protection Lamp
@@ -322,7 +765,7 @@ class MF4Reader:
         dbc_msg = self.database.get_message(dtc_active_msg)
         if dbc_msg is None:
             print('No prototype for DTC message found')
-            return
+            return None
         dtc_lamps =[dbc_msg.get_signal(sig_PL),
                     dbc_msg.get_signal(sig_AWL),
                     dbc_msg.get_signal(sig_RLS),
@@ -334,60 +777,131 @@ class MF4Reader:
                        dbc_msg.get_signal('DTC5')]
         if None in dtc_lamps or None in dtc_signals:
             print('Unsupported DTC frame format. Missing signals')
-            return
+            return None
 
-        # fetch all message frames
-        trace_data = self.get_message(dtc_active_msg)
-        if trace_data is None:
+        # all DM01 frames
+        if self.lazy:
+            msg_log = self.__load_message(dtc_active_msg)
+        else:
+            msg_log = next((x for x in self.msg_frames if x.msg is dbc_msg), None)
+        if msg_log is None:
             print(f'No DTC active message in the logs.')
+            return None
+
+        self._dtc_index = self.DtcIndex(msg_log, dtc_signals, dtc_lamps)
+        return self._dtc_index
+
+    def get_active_dtcs(self) -> np.ndarray | None:
+        """
+        :return: all DTCs found in the logs, see MF4Reader.DtcIndex.summary
+        """
+        dtc_index = self.get_dtc_index()
+        if dtc_index is None:
+            return None
+        return dtc_index.summary()
+
+    def plot_dtc(self, spn, fmi, sa: int = None, channel: int = None):
+        dtc_index = self.get_dtc_index()
+        if dtc_index is None:
+            return
+
+        rows = dtc_index.history(spn, fmi)
+        if len(rows) == 0:
+            print(f'No DTC {spn}.{fmi} in the logs.')
+            return
+
+        # select source and CAN, same as for message traces
+        trace_data = self.TraceData(SA=sa, CAN=channel)
+        sa_list = np.unique(rows['sa']).tolist()
+        if trace_data.SA is None:
+            if len(sa_list) > 1:
+                trace_data.SA = self.TraceData.select_sa(sa_list)
+            else:
+                trace_data.SA = sa_list[0]
+        rows = rows[rows['sa'] == trace_data.SA]
+        can_list = np.unique(rows['channel']).tolist()
+        if trace_data.CAN is not None:
+            rows = rows[rows['channel'] == trace_data.CAN]
+        elif len(can_list) > 1:
+            trace_data.CAN = self.TraceData.select_can(can_list)
+            rows = rows[rows['channel'] == trace_data.CAN]
+        if len(rows) == 0:
+            print(f'No DTC {spn}.{fmi} in the logs.')
             return
 
-        y_data = dict()
-        for lamp in dtc_lamps:
-            y_data[lamp.name] = []
-        t_data = []
-        for entry in trace_data.trace:
-            # check if contains correct DTC
-            dtc_list = []
-            for dts_sig in dtc_signals:
-                dtc = dts_sig.bytes2data(entry[1])
-                dtc = int(dtc)
-                if dtc != 0x0:  # dtc != 0xFFFF_FFFF
-                    dtc_list.append(dtc)
-
-            for dtc in dtc_list:
-                # remove CM and OC(4th byte)
-                tmp_val = dtc & 0xFF_FFFF
-                # get FMI
-                dtc_fmi = (tmp_val & 0x1F_0000) >> 16
-                # restore SPN(4th method, new)
-                dtc_spn = dtc & 0xFFFF
-                dtc_spn = dtc_spn + ((dtc & 0xE0_0000) >> 5)
-
-                # compare
-                if dtc_spn == spn and dtc_fmi == fmi:
-                    # found DTC of interest
-                    t_data.append(entry[0])
-                    for lamp in dtc_lamps:
-                        y_data[lamp.name].append(lamp.bytes2data(entry[1]))
         # draw
-        for lamp in dtc_lamps:
-            self.__append_figure(t_data, y_data[lamp.name], lamp, trace_data.to_title())
+        for lamp in dtc_index.lamps:
+            self.__append_figure(rows['time'], rows[lamp.name], lamp, trace_data.to_title())
 
         plt.draw()
         plt.pause(0.1)
 
     def get_messages_from_source(self, source_address: int) -> list:
+        return self.topology.from_source(source_address)
+
+    def get_messages_to_destination(self, destination_address: int) -> list:
+        return self.topology.to_destination(destination_address)
+
+    def get_messages_on_channel(self, channel: int) -> list:
+        return self.topology.on_channel(channel)
+
+    def get_topology(self) -> dict[tuple[int, int | None], int]:
+        """
+        :return: {(SA, DA): number of frames}. DA is None for broadcast (PDU2) messages
+        """
+        return dict(self.topology.pairs)
+
+    def get_bus_stats(self, msg_name: str = None, sa: int = None, da: int = None,
+                      channel: int = None) -> np.ndarray:
+        """
+        frame statistics of eagerly read logs, see MF4Reader.BusStats
+        :return: rows of BusStats table matching all given filters
+        """
+        return self.bus_stats.query(msg_name=msg_name, sa=sa, da=da, channel=channel)
+
+    def get_bus_load(self, bitrate: int = 250000) -> dict[int, float]:
+        """
+        :param bitrate: bus bitrate, bit/s
+        :return: {channel: bus load, 0..1} of all raw frames
+        """
+        if self.__has_lazy_files():
+            raise Exception('Bus load is not available in lazy mode, MF4 files are not read at start')
+        return self.bus_load.load(bitrate)
+
+    def __has_lazy_files(self) -> bool:
+        return self.lazy and len(self._log_index.time_ranges) > 0
+
+    def check_cycle_times(self, tolerance: float = 0.5) -> list[tuple]:
+        """
+        compares cycle times of logged messages to GenMsgCycleTime of dbc
+        :param tolerance: allowed relative excess of max cycle time over GenMsgCycleTime
+        :return: list of (message name, 'missing' or 'late', GenMsgCycleTime s, max cycle s, SA, DA, channel).
+            Missing messages have None for the last four
+        """
+        if self.__has_lazy_files():
+            # messages of not yet loaded MF4 files would be reported missing
+            raise Exception('Cycle time check is not available in lazy mode, MF4 files are not read at start')
         out = []
-        for msg_log in self.msg_frames:
-            if msg_log.msg not in out:
-                if msg_log.has_sa(source_address):
-                    out.append(msg_log.msg)
+        for dbc_msg in self.database.messages:
+            cycle_time = self.database.get_cycle_time(dbc_msg)
+            if cycle_time is None:
+                continue
+            cycle_time /= 1000
+            rows = self.bus_stats.query(msg_name=dbc_msg.name)
+            if len(rows) == 0:
+                out.append((dbc_msg.name, 'missing', cycle_time, None, None, None, None))
+                continue
+            late = rows[rows['cycle_max'] > cycle_time * (1 + tolerance)]
+            for row in late:
+                da = int(row['da']) if row['da'] >= 0 else None
+                out.append((dbc_msg.name, 'late', cycle_time, float(row['cycle_max']), int(row['sa']), da,
+                            int(row['channel'])))
         return out
 
     @dataclass
     class TraceData:
-        trace: list = None
+        # (timestamps, payload matrix) views
+        trace: tuple = None
         # frame: Message
         SA: int = None
         DA: int = None
@@ -439,15 +953,1261 @@ class MF4Reader:
             can_key = int(input(''))
             return can_key
 
+    class PlotFigure:
+        """
+        Stacked signal axes sharing the x axis. Axes are added and removed in place,
+        the remaining axes only move to their new grid cell and are not redrawn from data
+        """
+        def __init__(self, on_close):
+            self.figure = plt.figure()
+            self.figure.canvas.mpl_connect('close_event', on_close)
+            # (signal, title, time, values) of each axes, arrays are kept by reference
+            self.traces: list[tuple] = []
+
+        def __len__(self):
+            return len(self.traces)
+
+        def add(self, signal: Signal, title: str, t: np.ndarray, y: np.ndarray):
+            """
+            Append an empty axes at the bottom of the figure
+            :return: new axes
+            """
+            grid = self.__relayout(len(self.traces) + 1)
+            axes = self.figure.axes
+            ax = self.figure.add_subplot(grid[len(self.traces), 0], sharex=axes[0] if axes else None)
+            self.traces.append((signal, title, t, y))
+            self.__update_labels()
+            return ax
+
+        def remove(self, index: int):
+            self.figure.delaxes(self.figure.axes[index])
+            del self.traces[index]
+            self.__relayout(len(self.traces))
+            self.__update_labels()
+            self.figure.canvas.draw_idle()
+
+        def __relayout(self, rows: int) -> GridSpec:
+            grid = GridSpec(rows, 1, figure=self.figure)
+            for i, ax in enumerate(self.figure.axes):
+                ax.set_subplotspec(grid[i, 0])
+            return grid
+
+        def __update_labels(self):
+            # x tick labels only under the bottom axes
+            axes = self.figure.axes
+            for ax in axes[:-1]:
+                ax.tick_params(labelbottom=False)
+            if axes:
+                axes[-1].tick_params(labelbottom=True)
+
+    class IngestCache:
+        """
+        on-disk cache of ingested log files. Each file gets a folder with timestamp and payload length
+        columns, one payload column per width class (see FrameBuffer.width_for) as .npy files and
+        a manifest of buckets, keyed by file path, size, modification time and hash of dbc files
+        """
+        VERSION = 4
+        MANIFEST = 'manifest.json'
+
+        def __init__(self, folder: Path, dbc_hash: str):
+            self.folder = folder
+            self.dbc_hash = dbc_hash
+            self.folder.mkdir(parents=True, exist_ok=True)
+
+        def __entry(self, fp: Path) -> Path:
+            return self.folder / hashlib.sha1(str(fp.resolve()).encode('utf-8')).hexdigest()
+
+        def __fingerprint(self, fp: Path) -> dict:
+            stat = fp.stat()
+            return {
+                'version': self.VERSION,
+                'path': str(fp.resolve()),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'dbc_hash': self.dbc_hash,
+            }
+
+        def load(self, fp: Path) -> tuple | None:
+            """
+            :return: same as MF4Reader.ingest_log_file, columns are memory mapped. None if file
+                is not in cache or has changed
+            """
+            entry = self.__entry(fp)
+            try:
+                with (entry / self.MANIFEST).open('r') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                return None
+            if manifest.get('fingerprint') != self.__fingerprint(fp):
+                return None
+
+            time = np.load(entry / 'time.npy', mmap_mode='r')
+            length = np.load(entry / 'length.npy', mmap_mode='r')
+            data = {width: np.load(entry / f'data{width}.npy', mmap_mode='r') for width in manifest['widths']}
+            buckets = []
+            for b_pgn, b_da, b_sa, channel, start, end, width, d_start in manifest['buckets']:
+                b_data = data[width][d_start:d_start + end - start]
+                buckets.append((b_pgn, b_da, b_sa, channel, time[start:end], b_data, length[start:end]))
+            unknown_ids = {int(k): v for k, v in manifest['unknown_ids'].items()}
+            channel_load = {int(k): v for k, v in manifest['channel_load'].items()}
+            return manifest['can_channels'], buckets, unknown_ids, channel_load
+
+        def save(self, fp: Path, ingested: tuple):
+            can_channels, buckets, unknown_ids, channel_load = ingested
+            entry = self.__entry(fp)
+            # per process, readers sharing the cache may save the same file at once
+            tmp_entry = entry.with_name(f'{entry.name}.{os.getpid()}.tmp')
+            if tmp_entry.exists():
+                shutil.rmtree(tmp_entry)
+            tmp_entry.mkdir()
+
+            # all buckets in one set of columns, payloads in a column of their width class,
+            # so few long multi-packet payloads don't widen all classic frames
+            count = sum(len(x[4]) for x in buckets)
+            widths = [MF4Reader.FrameBuffer.width_for(int(x[6].max()) if len(x[6]) else 0) for x in buckets]
+            class_counts = dict()
+            for bucket, width in zip(buckets, widths):
+                class_counts[width] = class_counts.get(width, 0) + len(bucket[4])
+            time = np.empty(count, dtype=np.float64)
+            length = np.empty(count, dtype=np.uint16)
+            data = {width: np.zeros((n, width), dtype=np.uint8) for width, n in class_counts.items()}
+            class_start = dict.fromkeys(class_counts, 0)
+            manifest_buckets = []
+            start = 0
+            for (b_pgn, b_da, b_sa, channel, t, b_data, b_length), width in zip(buckets, widths):
+                end = start + len(t)
+                time[start:end] = t
+                length[start:end] = b_length
+                d_start = class_start[width]
+                copy_width = min(width, b_data.shape[1])
+                data[width][d_start:d_start + len(t), :copy_width] = b_data[:, :copy_width]
+                class_start[width] = d_start + len(t)
+                manifest_buckets.append([b_pgn, b_da, b_sa, channel, start, end, width, d_start])
+                start = end
+            np.save(tmp_entry / 'time.npy', time)
+            np.save(tmp_entry / 'length.npy', length)
+            for width, column in data.items():
+                np.save(tmp_entry / f'data{width}.npy', column)
+
+            manifest = {
+                'fingerprint': self.__fingerprint(fp),
+                'can_channels': [int(x) for x in can_channels],
+                'unknown_ids': {str(k): v for k, v in unknown_ids.items()},
+                'channel_load': {str(k): v for k, v in channel_load.items()},
+                'widths': sorted(data),
+                'buckets': manifest_buckets,
+            }
+            with (tmp_entry / self.MANIFEST).open('w') as f:
+                json.dump(manifest, f)
+
+            # replace old entry
+            if entry.exists():
+                shutil.rmtree(entry, ignore_errors=True)
+            try:
+                tmp_entry.rename(entry)
+            except OSError:
+                # saved by another process meanwhile
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    class BlfBlockReader:
+        """
+        reads CAN and CAN FD frames of BLF file straight from decompressed object blocks into
+        columns, without per-frame message objects
+        """
+        # frames per batch of buckets
+        SIZE = 1 << 20
+        # decompressed bytes parsed at once, containers are small
+        BLOCK_SIZE = 1 << 23
+
+        BASE_HEADER = struct.Struct('<4sHHLL')
+        SIGNATURE = int.from_bytes(b'LOBJ', 'little')
+        # zero bytes after a block, at least the widest gathered field
+        PADDING = 64
+        CONTAINER_HEADER = struct.Struct('<H6xL4x')
+        # object types
+        CAN_MESSAGE = 1
+        LOG_CONTAINER = 10
+        CAN_MESSAGE2 = 86
+        CAN_FD_MESSAGE = 100
+        CAN_FD_MESSAGE_64 = 101
+        # compression
+        NO_COMPRESSION = 0
+        ZLIB_DEFLATE = 2
+
+        def __init__(self, fp: Path):
+            self.fp = fp
+
+        def buckets(self, t_offset: float, tp: 'MF4Reader.TpReassembler' = None,
+                    bus_load: 'MF4Reader.BusLoad' = None):
+            """
+            :param t_offset: added to all timestamps, which are relative to the file start
+            :param tp: reassembles multi-packet messages, None to disable
+            :param bus_load: all raw frames are counted here, None to disable
+            :return: iterator of (pgn, da, sa, channel, timestamps, payload matrix, payload length) buckets
+            """
+            # file header is parsed by python-can, objects are read here
+            with BLFReader(self.fp) as log_f:
+                stream = log_f.file
+                tail = b''
+                blocks = []
+                blocks_size = 0
+                batch = []
+                batch_len = 0
+                while True:
+                    header = stream.read(self.BASE_HEADER.size)
+                    if len(header) < self.BASE_HEADER.size:
+                        # EOF
+                        break
+                    signature, _, _, obj_size, obj_type = self.BASE_HEADER.unpack(header)
+                    if signature != b'LOBJ':
+                        raise Exception(f'Bad BLF object in {self.fp}')
+                    obj_data = stream.read(obj_size - self.BASE_HEADER.size)
+                    # padding
+                    stream.read(obj_size % 4)
+                    if obj_type != self.LOG_CONTAINER:
+                        continue
+
+                    method, _ = self.CONTAINER_HEADER.unpack_from(obj_data)
+                    block = obj_data[self.CONTAINER_HEADER.size:]
+                    if method == self.ZLIB_DEFLATE:
+                        block = zlib.decompress(block)
+                    elif method != self.NO_COMPRESSION:
+                        # unknown compression
+                        continue
+
+                    blocks.append(block)
+                    blocks_size += len(block)
+                    if blocks_size < self.BLOCK_SIZE:
+                        continue
+
+                    # objects may continue in the next container
+                    columns, tail = self.__parse_block(b''.join([tail] + blocks))
+                    blocks = []
+                    blocks_size = 0
+                    if columns is not None:
+                        batch.append(columns)
+                        batch_len += len(columns[0])
+                    if batch_len >= self.SIZE:
+                        yield from self.__to_buckets(batch, t_offset, tp, bus_load)
+                        batch = []
+                        batch_len = 0
+                if blocks:
+                    columns, tail = self.__parse_block(b''.join([tail] + blocks))
+                    if columns is not None:
+                        batch.append(columns)
+                yield from self.__to_buckets(batch, t_offset, tp, bus_load)
+
+        @staticmethod
+        def __gather(buf: np.ndarray, offsets: np.ndarray, width: int) -> np.ndarray:
+            """
+            :param buf: block bytes padded with PADDING zero bytes, so fields at the block end fit
+            :return: N x width matrix of bytes starting at offsets
+            """
+            return np.lib.stride_tricks.sliding_window_view(buf, width)[offsets]
+
+        @staticmethod
+        def __field(rows: np.ndarray, start: int, dtype: str) -> np.ndarray:
+            """
+            :return: little endian field at start of each row of gathered bytes
+            """
+            size = np.dtype(dtype).itemsize
+            return np.ascontiguousarray(rows[:, start:start + size]).view(dtype)[:, 0]
+
+        def __scan_objects(self, data: bytes, buf: np.ndarray) -> tuple[np.ndarray, int]:
+            """
+            finds object offsets in one pass: every signature in the block is taken as object start, the
+            chain of object sizes from the block start drops signatures found inside payloads
+            :return: offsets of complete objects, start of incomplete last object
+            """
+            data_len = len(data)
+            # signatures, objects may be followed by up to 3 padding bytes
+            first = np.flatnonzero(buf[:max(data_len - 3, 0)] == ord('L'))
+            candidates = first[self.__field(self.__gather(buf, first, 4), 0, '<u4') == self.SIGNATURE]
+            if len(candidates) == 0:
+                if data_len >= 8:
+                    raise Exception(f'Bad BLF object in {self.fp}')
+                return candidates, 0
+            if candidates[0] > 3:
+                raise Exception(f'Bad BLF object in {self.fp}')
+            obj_sizes = self.__field(self.__gather(buf, candidates, 12), 8, '<u4').astype(np.int64)
+            ends = candidates + obj_sizes
+            # incomplete header reads zero size from padding
+            complete = (candidates + self.BASE_HEADER.size <= data_len) & (ends <= data_len)
+            # index of object after each object, count at block end, -1 if there is no object
+            count = len(candidates)
+            following = np.searchsorted(candidates, ends)
+            found = candidates[np.minimum(following, count - 1)]
+            following[(following < count) & (found - ends > 3)] = -1
+            following[obj_sizes < self.BASE_HEADER.size] = -1
+
+            # objects between breaks follow each other, only breaks are walked, e.g. signatures in payloads
+            is_break = ~complete | (following != np.arange(1, count + 1))
+            is_break[-1] = True
+            breaks = np.flatnonzero(is_break)
+            chain = []
+            i = 0
+            while 0 <= i < count:
+                j = int(breaks[np.searchsorted(breaks, i)])
+                if not complete[j]:
+                    chain.append(np.arange(i, j))
+                    i = j
+                    break
+                chain.append(np.arange(i, j + 1))
+                i = int(following[j])
+            chain = np.concatenate(chain)
+            if i < 0:
+                raise Exception(f'Bad BLF object in {self.fp}')
+            if i < count:
+                # last object continues in the next block
+                return candidates[chain], int(candidates[i])
+            # only padding or part of the next signature left
+            tail_start = int(ends[chain[-1]])
+            if data_len - tail_start >= 8:
+                raise Exception(f'Bad BLF object in {self.fp}')
+            return candidates[chain], tail_start
+
+        def __parse_block(self, data: bytes) -> tuple[tuple | None, bytes]:
+            """
+            :return: (timestamps, raw IDs, channels, payload matrix, payload length) columns of CAN frames
+                or None, incomplete last object
+            """
+            buf = np.frombuffer(data + bytes(self.PADDING), dtype=np.uint8)
+            gather = self.__gather
+            offsets, start = self.__scan_objects(data, buf)
+            tail = data[start:]
+            if len(offsets) == 0:
+                return None, tail
+
+            # object header, same offsets in v1 and v2, one gather per object
+            field = self.__field
+            header = gather(buf, offsets, 32)
+            obj_types = field(header, 12, '<u4')
+            is_can = (obj_types == self.CAN_MESSAGE) | (obj_types == self.CAN_MESSAGE2)
+            is_fd = obj_types == self.CAN_FD_MESSAGE
+            is_fd64 = obj_types == self.CAN_FD_MESSAGE_64
+            keep = is_can | is_fd | is_fd64
+            if not keep.any():
+                return None, tail
+            if not keep.all():
+                offsets = offsets[keep]
+                header = header[keep]
+                is_can, is_fd, is_fd64 = is_can[keep], is_fd[keep], is_fd64[keep]
+            header_sizes = field(header, 4, '<u2').astype(np.int64)
+            obj_sizes = field(header, 8, '<u4').astype(np.int64)
+            timestamps = field(header, 24, '<u8') * np.where(field(header, 16, '<u4') == 1, 1e-5, 1e-9)
+
+            # frame, one gather per object type
+            pos = offsets + header_sizes
+            count = len(offsets)
+            can_ids = np.zeros(count, dtype=np.int64)
+            channels = np.zeros(count, dtype=np.int64)
+            length = np.zeros(count, dtype=np.int64)
+            width = 64 if (is_fd | is_fd64).any() else 8
+            payload = np.zeros((count, width), dtype=np.uint8)
+            if is_can.any():
+                # usually all frames are classic CAN, skip masking then
+                sel = slice(None) if is_can.all() else is_can
+                frame = gather(buf, pos[sel], 16)
+                channels[sel] = field(frame, 0, '<u2')
+                length[sel] = np.minimum(frame[:, 3], 8)
+                can_ids[sel] = field(frame, 4, '<u4')
+                payload[sel, :8] = frame[:, 8:16]
+            if is_fd.any():
+                frame = gather(buf, pos[is_fd], 84)
+                channels[is_fd] = field(frame, 0, '<u2')
+                length[is_fd] = np.minimum(frame[:, 14], 64)
+                can_ids[is_fd] = field(frame, 4, '<u4')
+                payload[is_fd] = frame[:, 20:84]
+            if is_fd64.any():
+                frame = gather(buf, pos[is_fd64], 104)
+                channels[is_fd64] = frame[:, 0]
+                length[is_fd64] = np.minimum(frame[:, 2], 64)
+                can_ids[is_fd64] = field(frame, 4, '<u4')
+                # data field ends at extended data or at object end
+                ext_offset = frame[:, 35].astype(np.int64)
+                available = np.where(ext_offset != 0, ext_offset, obj_sizes[is_fd64]) - header_sizes[is_fd64] - 40
+                fd64_data = frame[:, 40:104].copy()
+                fd64_data[np.arange(64) >= available[:, None]] = 0
+                payload[is_fd64] = fd64_data
+            # keep extended frame flag in bit 31, same as in MF4
+            raw_ids = can_ids & 0x9FFFFFFF
+            channels -= 1
+            return (timestamps, raw_ids, channels, payload, length), tail
+
+        @staticmethod
+        def __to_buckets(batch: list, t_offset: float, tp: 'MF4Reader.TpReassembler', bus_load: 'MF4Reader.BusLoad'):
+            if len(batch) == 0:
+                return
+            t = t_offset + np.concatenate([x[0] for x in batch])
+            raw_ids = np.concatenate([x[1] for x in batch])
+            channels = np.concatenate([x[2] for x in batch])
+            width = max(x[3].shape[1] for x in batch)
+            data = np.zeros((len(t), width), dtype=np.uint8)
+            start = 0
+            for x in batch:
+                data[start:start + len(x[3]), :x[3].shape[1]] = x[3]
+                start += len(x[3])
+            length = np.concatenate([x[4] for x in batch])
+            if bus_load is not None:
+                bus_load.add(channels, raw_ids, length, t)
+
+            pgn, sa, da = MF4Reader.split_ids(raw_ids)
+            for b_pgn, b_da, b_sa, channel, sel in MF4Reader.group_frames(pgn, da, sa, channels):
+                yield b_pgn, b_da, b_sa, channel, t[sel], data[sel], length[sel]
+            if tp is not None:
+                yield from tp.feed(pgn, da, sa, channels, t, data)
+
+    class LogIndex:
+        """
+        lazy mode index of MF4 files: which channel groups contain which messages
+        """
+        def __init__(self):
+            # PGN -> {file: [(channel group, time offset)]}
+            self._pgn_groups: dict[int, dict[Path, list[tuple[int, float]]]] = dict()
+            # (channel, raw ID) of all indexed frames
+            self._bus_ids: set[tuple[int, int]] = set()
+            # (file, channel group) -> (first timestamp, last timestamp)
+            self.time_ranges: dict[tuple[Path, int], tuple[float, float]] = dict()
+
+        def add_file(self, fp: Path, log_f: MDF, t_offset: float):
+            group_ids: dict[int, set[int]] = dict()
+            for channel, bus_map in log_f.bus_logging_map['CAN'].items():
+                for msg_id, group in bus_map.items():
+                    group_ids.setdefault(group, set()).add(msg_id)
+                    # bus logging map has 29 bit IDs, restore extended frame flag
+                    self._bus_ids.add((channel, msg_id | (1 << 31) if msg_id > 0x7FF else msg_id))
+
+            for group, msg_ids in group_ids.items():
+                msg_ids = np.array(sorted(msg_ids), dtype=np.int64)
+                # bus logging map has 29 bit IDs, restore extended frame flag
+                msg_ids = np.where(msg_ids > 0x7FF, msg_ids | (1 << 31), msg_ids)
+                pgn, _, _ = MF4Reader.split_ids(msg_ids)
+                for msg_pgn in np.unique(pgn).tolist():
+                    self._pgn_groups.setdefault(msg_pgn, dict()).setdefault(fp, []).append((group, t_offset))
+
+                # time range, read first and last records only
+                cycles = log_f.groups[group].channel_group.cycles_nr
+                if cycles > 0:
+                    t_first = log_f.get_master(group, record_offset=0, record_count=1)[0]
+                    t_last = log_f.get_master(group, record_offset=cycles - 1, record_count=1)[0]
+                    self.time_ranges[(fp, group)] = (t_offset + t_first, t_offset + t_last)
+
+        def get_groups(self, pgn: int) -> dict[Path, list[tuple[int, float]]]:
+            """
+            :param pgn: PGN with zeroed DA for PDU1
+            :return: {file: [(channel group, time offset)]}
+            """
+            return self._pgn_groups.get(pgn, dict())
+
+        def add_to_topology(self, topology: 'MF4Reader.BusTopology', router: 'MF4Reader.MessageRouter'):
+            """
+            adds indexed messages to topology. Frames are not read, so they are counted as 0
+            """
+            if len(self._bus_ids) == 0:
+                return
+            channels, msg_ids = (np.array(x, dtype=np.int64) for x in zip(*self._bus_ids))
+            pgn, sa, da = MF4Reader.split_ids(msg_ids)
+            for msg_pgn, msg_da, msg_sa, channel in zip(pgn.tolist(), da.tolist(), sa.tolist(), channels.tolist()):
+                msg_log = router.lookup(msg_pgn)
+                if msg_log is not None:
+                    topology.add(msg_log.msg, msg_da, msg_sa, channel, 0)
+
+        def get_tp_groups(self) -> dict[Path, list[tuple[int, float]]]:
+            """
+            :return: {file: [(channel group, time offset)]} of groups with TP.CM or TP.DT frames
+            """
+            out = dict()
+            for pgn, file_groups in self._pgn_groups.items():
+                if pgn & 0x3FFFF in (MF4Reader.TpReassembler.PGN_TP_CM, MF4Reader.TpReassembler.PGN_TP_DT):
+                    for fp, groups in file_groups.items():
+                        out.setdefault(fp, []).extend(groups)
+            return out
+
+        def overlaps(self, fp: Path, group: int, t_start: float = None, t_end: float = None) -> bool:
+            """
+            :return: True if channel group may have frames within [t_start, t_end]
+            """
+            if (fp, group) not in self.time_ranges:
+                # empty group
+                return False
+            t_first, t_last = self.time_ranges[(fp, group)]
+            return (t_start is None or t_last >= t_start) and (t_end is None or t_first <= t_end)
+
+    class BusTopology:
+        """
+        inverted indexes of ingested messages by source, destination and channel, and frame counts
+        of (SA, DA) pairs
+        """
+        def __init__(self):
+            # address -> messages, dicts keep order and dedupe
+            self._sources: dict[int, dict[Message, None]] = dict()
+            self._destinations: dict[int, dict[Message, None]] = dict()
+            self._channels: dict[int, dict[Message, None]] = dict()
+            # (SA, DA) -> number of frames, DA is None for PDU2
+            self.pairs: dict[tuple[int, int | None], int] = dict()
+
+        def add(self, msg: Message, da: int | None, sa: int, channel: int, count: int):
+            """
+            :param da: destination address, None or -1 for PDU2
+            """
+            if da is not None and da < 0:
+                da = None
+            self._sources.setdefault(sa, dict())[msg] = None
+            if da is not None:
+                self._destinations.setdefault(da, dict())[msg] = None
+            self._channels.setdefault(channel, dict())[msg] = None
+            self.pairs[(sa, da)] = self.pairs.get((sa, da), 0) + count
+
+        def from_source(self, sa: int) -> list[Message]:
+            return list(self._sources.get(sa, ()))
+
+        def to_destination(self, da: int) -> list[Message]:
+            return list(self._destinations.get(da, ()))
+
+        def on_channel(self, channel: int) -> list[Message]:
+            return list(self._channels.get(channel, ()))
+
+        def sources(self) -> list[int]:
+            return sorted(self._sources.keys())
+
+        def destinations(self) -> list[int]:
+            return sorted(self._destinations.keys())
+
+    class TpReassembler:
+        """
+        J1939 transport protocol: reassembles multi-packet messages of TP.CM (BAM or RTS/CTS) and TP.DT
+        frames. Open sessions are kept per (SA, DA, channel) between chunks of one log file, chunks are
+        expected in time order. Frames of several MF4 channel groups overlap in time, they are kept by add
+        and fed merged in time order by flush
+        """
+        PGN_TP_CM = 0xEC00
+        PGN_TP_DT = 0xEB00
+        # TP.CM control byte
+        CM_RTS = 16
+        CM_BAM = 32
+        CM_ABORT = 255
+        # max time between packets of a session, s
+        TIMEOUT = 1.25
+        MAX_SIZE = 1785
+        MAX_SESSIONS = 1024
+
+        def __init__(self, known_pgns: set = None):
+            # PGN without priority -> known PGN, TP.CM doesn't have priority
+            self._pgn_map: dict[int, int] = dict()
+            for pgn in sorted(known_pgns or ()):
+                self._pgn_map.setdefault(pgn & 0x3FFFF, pgn)
+            # (SA, DA, channel) -> [PGN, size, number of packets, next sequence number, last time, payload]
+            self._sessions: dict[tuple[int, int, int], list] = dict()
+            # buckets of TP frames waiting for flush
+            self._pending: list[tuple] = []
+
+        def __expire(self, t: float):
+            sessions = self._sessions
+            for key in [k for k, v in sessions.items() if t - v[4] > self.TIMEOUT]:
+                del sessions[key]
+            # still too many, drop the oldest
+            while len(sessions) > self.MAX_SESSIONS:
+                del sessions[min(sessions, key=lambda k: sessions[k][4])]
+
+        def add(self, bucket: tuple):
+            """
+            keeps TP frames of a bucket until flush, other buckets are ignored
+            :param bucket: (pgn, da, sa, channel, timestamps, payload matrix, payload length) bucket of raw frames
+            """
+            if bucket[0] & 0x3FFFF in (self.PGN_TP_CM, self.PGN_TP_DT):
+                self._pending.append(bucket)
+
+        def flush(self):
+            """
+            feeds kept TP frames merged in time order
+            :return: iterator of (pgn, da, sa, channel, timestamps, payload matrix, payload length) buckets
+                of completed messages
+            """
+            pending = self._pending
+            self._pending = []
+            if len(pending) == 0:
+                return
+            counts = [len(x[4]) for x in pending]
+            pgn, da, sa, channel = (np.repeat(np.array([x[i] for x in pending], dtype=np.int64), counts)
+                                    for i in range(4))
+            t = np.concatenate([x[4] for x in pending])
+            data = np.zeros((len(t), 8), dtype=np.uint8)
+            start = 0
+            for x in pending:
+                width = min(8, x[5].shape[1])
+                data[start:start + len(x[4]), :width] = x[5][:, :width]
+                start += len(x[4])
+            yield from self.feed(pgn, da, sa, channel, t, data)
+
+        def feed(self, pgn: np.ndarray, da: np.ndarray, sa: np.ndarray, channel: np.ndarray, t: np.ndarray,
+                 data: np.ndarray):
+            """
+            processes TP frames of a chunk, other frames are ignored
+            :param pgn, da, sa: same as from MF4Reader.split_ids
+            :return: iterator of (pgn, da, sa, channel, timestamps, payload matrix, payload length) buckets
+                of messages completed in this chunk
+            """
+            base_pgn = pgn & 0x3FFFF
+            idx = np.nonzero((base_pgn == self.PGN_TP_CM) | (base_pgn == self.PGN_TP_DT))[0]
+            if len(idx) == 0:
+                return
+            idx = idx[np.argsort(t[idx], kind='stable')]
+            payloads = np.zeros((len(idx), 8), dtype=np.uint8)
+            width = min(8, data.shape[1])
+            payloads[:, :width] = data[idx, :width]
+
+            done = []
+            sessions = self._sessions
+            for is_cm, f_da, f_sa, f_ch, f_t, payload in zip((base_pgn[idx] == self.PGN_TP_CM).tolist(),
+                                                              da[idx].tolist(), sa[idx].tolist(),
+                                                              channel[idx].tolist(), t[idx].tolist(),
+                                                              payloads.tolist()):
+                key = (f_sa, f_da, f_ch)
+                if is_cm:
+                    control = payload[0]
+                    if control == self.CM_RTS or control == self.CM_BAM:
+                        size = payload[1] | (payload[2] << 8)
+                        packets = payload[3]
+                        if 8 < size <= self.MAX_SIZE and packets == (size + 6) // 7:
+                            # new session replaces unfinished one
+                            tp_pgn = payload[5] | (payload[6] << 8) | (payload[7] << 16)
+                            sessions[key] = [tp_pgn, size, packets, 1, f_t, bytearray()]
+                            if len(sessions) > self.MAX_SESSIONS:
+                                self.__expire(f_t)
+                        else:
+                            sessions.pop(key, None)
+                    elif control == self.CM_ABORT:
+                        # either side may abort
+                        sessions.pop(key, None)
+                        sessions.pop((f_da, f_sa, f_ch), None)
+                    continue
+
+                session = sessions.get(key)
+                if session is None:
+                    continue
+                if f_t - session[4] > self.TIMEOUT:
+                    del sessions[key]
+                    continue
+                if f_t < session[4]:
+                    # out of order, not a packet of this session
+                    continue
+                seq = payload[0]
+                if seq != session[3]:
+                    if seq > session[3]:
+                        # lost packet
+                        del sessions[key]
+                    # else retransmitted packet
+                    continue
+                session[5].extend(payload[1:])
+                session[3] += 1
+                session[4] = f_t
+                if seq == session[2]:
+                    del sessions[key]
+                    done.append((session[0], f_da, f_sa, f_ch, f_t, session[5][:session[1]]))
+
+            if len(done) == 0:
+                return
+            out_pgn = np.empty(len(done), dtype=np.int64)
+            out_da = np.empty(len(done), dtype=np.int64)
+            out_sa = np.empty(len(done), dtype=np.int64)
+            out_ch = np.empty(len(done), dtype=np.int64)
+            out_t = np.empty(len(done), dtype=np.float64)
+            out_len = np.empty(len(done), dtype=np.int64)
+            out_data = np.zeros((len(done), MF4Reader.FrameBuffer.width_for(max(len(x[5]) for x in done))),
+                                dtype=np.uint8)
+            for i, (tp_pgn, f_da, f_sa, f_ch, f_t, payload) in enumerate(done):
+                if ((tp_pgn >> 8) & 0xFF) < 240:
+                    # PDU1, DA of the session
+                    tp_pgn &= 0x3FF00
+                else:
+                    f_da = -1
+                out_pgn[i] = self._pgn_map.get(tp_pgn, tp_pgn)
+                out_da[i], out_sa[i], out_ch[i], out_t[i], out_len[i] = f_da, f_sa, f_ch, f_t, len(payload)
+                out_data[i, :len(payload)] = np.frombuffer(bytes(payload), dtype=np.uint8)
+            for b_pgn, b_da, b_sa, channel, sel in MF4Reader.group_frames(out_pgn, out_da, out_sa, out_ch):
+                yield b_pgn, b_da, b_sa, channel, out_t[sel], out_data[sel], out_len[sel]
+
+    class DtcIndex:
+        """
+        DTCs reported in DM01 frames, one row per DTC per frame with lamp states of the frame.
+        Rows are sorted by (SPN, FMI, SA, channel, time)
+        """
+        def __init__(self, msg_log, dtc_signals: list[Signal], lamps: list[Signal]):
+            self.lamps = lamps
+
+            parts = []
+            for _, sa, channel, frames in msg_log.buckets():
+                lamp_values = [lamp.frames2data(frames.data) for lamp in lamps]
+                for dtc_sig in dtc_signals:
+                    dtc = dtc_sig.frames2raw(frames.data).astype(np.int64)
+                    # empty slots
+                    valid = (dtc != 0x0) & (dtc != 0xFFFF_FFFF)
+                    if not valid.any():
+                        continue
+                    dtc = dtc[valid]
+                    part = np.empty(len(dtc), dtype=self.__dtype(lamps))
+                    # restore SPN(4th method, new)
+                    part['spn'] = (dtc & 0xFFFF) + ((dtc & 0xE0_0000) >> 5)
+                    part['fmi'] = (dtc & 0x1F_0000) >> 16
+                    part['oc'] = (dtc >> 24) & 0x7F
+                    part['sa'] = sa
+                    part['channel'] = channel
+                    part['time'] = frames.time[valid]
+                    for lamp, values in zip(lamps, lamp_values):
+                        part[lamp.name] = values[valid]
+                    parts.append(part)
+
+            if len(parts) > 0:
+                table = np.concatenate(parts)
+            else:
+                table = np.empty(0, dtype=self.__dtype(lamps))
+            self.table = table[np.lexsort((table['time'], table['channel'], table['sa'], table['fmi'], table['spn']))]
+
+            # (SPN, FMI) -> rows
+            key = self.table['spn'] * 32 + self.table['fmi']
+            _, starts = np.unique(key, return_index=True)
+            ends = np.append(starts[1:], len(key))
+            self._ranges: dict[tuple[int, int], tuple[int, int]] = dict()
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                row = self.table[start]
+                self._ranges[(int(row['spn']), int(row['fmi']))] = (start, end)
+
+        @staticmethod
+        def __dtype(lamps: list[Signal]) -> np.dtype:
+            return np.dtype([('spn', np.int64), ('fmi', np.int64), ('oc', np.int64), ('sa', np.int64),
+                             ('channel', np.int64), ('time', np.float64)] +
+                            [(lamp.name, np.float64) for lamp in lamps])
+
+        def history(self, spn: int, fmi: int) -> np.ndarray:
+            """
+            :return: rows of given DTC, view of the table
+            """
+            start, end = self._ranges.get((spn, fmi), (0, 0))
+            return self.table[start:end]
+
+        def occurrences(self, spn: int, fmi: int, oc: int, sa: int) -> np.ndarray:
+            """
+            :return: timestamps of DTC reported with given occurrence count by given source
+            """
+            rows = self.history(spn, fmi)
+            return rows['time'][(rows['oc'] == oc) & (rows['sa'] == sa)]
+
+        def summary(self) -> np.ndarray:
+            """
+            :return: one row per (SPN, FMI, OC, SA) with number of frames, first and last timestamps
+            """
+            dtype = np.dtype([('spn', np.int64), ('fmi', np.int64), ('oc', np.int64), ('sa', np.int64),
+                              ('count', np.int64), ('t_first', np.float64), ('t_last', np.float64)])
+            keys = np.stack((self.table['spn'], self.table['fmi'], self.table['oc'], self.table['sa']), axis=1)
+            keys, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+            inverse = inverse.reshape(-1)
+            out = np.empty(len(keys), dtype=dtype)
+            for i, field in enumerate(('spn', 'fmi', 'oc', 'sa')):
+                out[field] = keys[:, i]
+            out['count'] = counts
+            out['t_first'] = np.inf
+            out['t_last'] = -np.inf
+            np.minimum.at(out['t_first'], inverse, self.table['time'])
+            np.maximum.at(out['t_last'], inverse, self.table['time'])
+            return out
+
+    class BusStats:
+        """
+        frame statistics per (PGN, DA, SA, channel) of time sorted frames: count, cycle time mean/min/max,
+        jitter (cycle time standard deviation), payload length histogram and nominal bits of the stored frames,
+        a reassembled multi-packet message counts as one frame. Cycle times are NaN for single frames, DA is -1
+        for PDU2. Bus load is counted over raw frames by MF4Reader.BusLoad
+        """
+        MAX_LENGTH = 64
+
+        def __init__(self):
+            self._rows = []
+            self._names = []
+            self.table: np.ndarray = None
+
+        def add(self, msg: Message, pgn: int, da: int, sa: int, channel: int, frames: 'MF4Reader.FrameBuffer'):
+            time = frames.time
+            length = frames.length
+            count = len(time)
+            if count > 1:
+                cycle = np.diff(time)
+                cycle_stats = (cycle.mean(), cycle.min(), cycle.max(), cycle.std())
+            else:
+                cycle_stats = (np.nan,) * 4
+            dlc_hist = np.bincount(np.minimum(length, self.MAX_LENGTH), minlength=self.MAX_LENGTH + 1)
+            # nominal frame size without stuff bits: header, CRC, EOF and IFS plus payload
+            overhead = 67 if msg.id & (1 << 31) else 47
+            bits = overhead * count + 8 * int(length.sum(dtype=np.int64))
+            self._rows.append((pgn, -1 if da is None else da, sa, channel, count) + cycle_stats +
+                              (time[0] if count else np.nan, time[-1] if count else np.nan, bits, dlc_hist))
+            self._names.append(msg.name)
+
+        def finalize(self):
+            name_len = max((len(x) for x in self._names), default=1)
+            dtype = np.dtype([('name', f'U{name_len}'), ('pgn', np.int64), ('da', np.int64), ('sa', np.int64),
+                              ('channel', np.int64), ('count', np.int64), ('cycle_mean', np.float64),
+                              ('cycle_min', np.float64), ('cycle_max', np.float64), ('jitter', np.float64),
+                              ('t_first', np.float64), ('t_last', np.float64), ('bits', np.int64),
+                              ('dlc_hist', np.int64, (self.MAX_LENGTH + 1,))])
+            self.table = np.array([(name,) + row for name, row in zip(self._names, self._rows)], dtype=dtype)
+            self._rows = []
+            self._names = []
+
+        def query(self, msg_name: str = None, sa: int = None, da: int = None, channel: int = None) -> np.ndarray:
+            """
+            :return: rows matching all given filters
+            """
+            found = np.ones(len(self.table), dtype=bool)
+            if msg_name is not None:
+                found &= self.table['name'] == msg_name
+            if sa is not None:
+                found &= self.table['sa'] == sa
+            if da is not None:
+                found &= self.table['da'] == da
+            if channel is not None:
+                found &= self.table['channel'] == channel
+            return self.table[found]
+
+    class BusLoad:
+        """
+        nominal bits per CAN channel of all raw frames, known to dbc or not, counted before
+        multi-packet reassembly
+        """
+        def __init__(self):
+            # channel -> [frames, bits, first timestamp, last timestamp]
+            self.channels: dict[int, list] = dict()
+
+        def add(self, channels: np.ndarray, raw_ids: np.ndarray, length: np.ndarray, time: np.ndarray):
+            """
+            :param raw_ids: CAN IDs with extended frame flag in bit 31
+            """
+            if len(time) == 0:
+                return
+            # nominal frame size without stuff bits: header, CRC, EOF and IFS plus payload
+            bits = np.where(raw_ids & (1 << 31), 67, 47) + 8 * length.astype(np.int64)
+            for channel in np.unique(channels).tolist():
+                sel = channels == channel
+                t = time[sel]
+                self.__add(channel, [int(np.count_nonzero(sel)), int(bits[sel].sum()), float(t.min()), float(t.max())])
+
+        def merge(self, channels: dict[int, list], t_offset: float = 0.0):
+            """
+            :param channels: BusLoad.channels of another file
+            :param t_offset: added to timestamps of channels
+            """
+            for channel, (count, bits, t_first, t_last) in channels.items():
+                self.__add(channel, [count, bits, t_first + t_offset, t_last + t_offset])
+
+        def __add(self, channel: int, row: list):
+            old = self.channels.get(channel)
+            if old is None:
+                self.channels[channel] = row
+            else:
+                self.channels[channel] = [old[0] + row[0], old[1] + row[1], min(old[2], row[2]), max(old[3], row[3])]
+
+        def load(self, bitrate: int) -> dict[int, float]:
+            """
+            :return: {channel: nominal bits / (log duration * bitrate)}
+            """
+            out = dict()
+            for channel, (_, bits, t_first, t_last) in sorted(self.channels.items()):
+                duration = t_last - t_first
+                out[channel] = bits / (duration * bitrate) if duration > 0 else 0.0
+            return out
+
+    class SignalExport:
+        """
+        streams decoded signals of message traces into one output, chunk by chunk.
+        csv: folder with one file per trace, columns time and signals
+        npz: one record array per trace with field time and float64 field per signal
+        mf4: one channel group per trace
+        """
+        FORMATS = ('csv', 'npz', 'mf4')
+
+        def __init__(self, path: Path, fmt: str):
+            if fmt not in self.FORMATS:
+                raise Exception(f'Unknown export format {fmt}, expected one of {self.FORMATS}')
+            self.path = path
+            self.fmt = fmt
+            self._out = None
+            self._names: list[str] = []
+            self._group: int | None = None
+            self._file = None
+
+            if fmt == 'csv':
+                path.mkdir(parents=True, exist_ok=True)
+            elif fmt == 'npz':
+                self._out = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+            else:
+                self._out = MDF(version='4.10')
+
+        @staticmethod
+        def trace_name(msg_name: str, trace_data: 'MF4Reader.TraceData') -> str:
+            """
+            :return: file name safe trace name, e.g. EEC1_SA00_CAN1
+            """
+            name = msg_name
+            if trace_data.SA is not None:
+                name += f'_SA{trace_data.SA:02X}'
+            if trace_data.DA is not None:
+                name += f'_DA{trace_data.DA:02X}'
+            if trace_data.CAN is not None:
+                name += f'_CAN{trace_data.CAN}'
+            return name
+
+        def begin(self, name: str, sig_names: list[str], count: int):
+            """
+            start a new trace
+            :param name: trace name
+            :param sig_names: signal columns
+            :param count: total number of rows of the trace
+            """
+            self._names = sig_names
+            if self.fmt == 'csv':
+                self._file = (self.path / (name + '.csv')).open('w', newline='\n')
+                self._file.write(','.join(['time'] + sig_names) + '\n')
+            elif self.fmt == 'npz':
+                dtype = np.dtype([('time', np.float64)] + [(x, np.float64) for x in sig_names])
+                self._file = self._out.open(name + '.npy', 'w', force_zip64=True)
+                # header of the whole array, rows are streamed after it
+                np.lib.format.write_array_header_2_0(
+                    self._file, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                                 'shape': (count,)})
+            else:
+                self._group = None
+                self._file = name
+
+        def write(self, time: np.ndarray, values: np.ndarray):
+            """
+            :param time: timestamps of the chunk
+            :param values: record array of signal values, see Message.frames2data
+            """
+            if self.fmt == 'csv':
+                columns = np.column_stack([time] + [values[x] for x in self._names])
+                np.savetxt(self._file, columns, fmt='%.10g', delimiter=',')
+            elif self.fmt == 'npz':
+                rows = np.empty(len(time), dtype=[('time', np.float64)] + [(x, np.float64) for x in self._names])
+                rows['time'] = time
+                for x in self._names:
+                    rows[x] = values[x]
+                self._file.write(rows.tobytes())
+            elif self._group is None:
+                self._group = self._out.append([MdfSignal(values[x], time, name=x) for x in self._names],
+                                               acq_name=self._file, comment=self._file)
+            else:
+                self._out.extend(self._group, [(time, None)] + [(values[x], None) for x in self._names])
+
+        def end(self):
+            if self.fmt in ('csv', 'npz'):
+                self._file.close()
+            self._file = None
+
+        def close(self):
+            if self.fmt == 'npz':
+                self._out.close()
+            elif self.fmt == 'mf4':
+                self._out.save(self.path, overwrite=True)
+                self._out.close()
+
+    class MessageRouter:
+        """
+        PGN dispatch table for message logs of a database
+        """
+        def __init__(self, messages: list, storage: 'MF4Reader.FrameStorage' = None):
+            self.msg_logs = []
+            self.unknown_ids: dict[int, int] = dict()
+            self._pgn_table: dict[int, MF4Reader.MessageLog | MF4Reader.MessageLogPdu1] = dict()
+
+            for dbc_msg in messages:
+                if Message.is_pdu1(dbc_msg.id):
+                    msg_log = MF4Reader.MessageLogPdu1(dbc_msg, storage)
+                else:
+                    msg_log = MF4Reader.MessageLog(dbc_msg, storage)
+                self.msg_logs.append(msg_log)
+                # first match wins
+                if msg_log.get_pgn() not in self._pgn_table:
+                    self._pgn_table[msg_log.get_pgn()] = msg_log
+
+        def get(self, pgn: int, count: int = 1):
+            """
+            :param pgn: PGN with zeroed DA for PDU1
+            :param count: number of frames, for unknown IDs statistics
+            :return: message log or None
+            """
+            msg_log = self._pgn_table.get(pgn)
+            if msg_log is None:
+                self.unknown_ids[pgn] = self.unknown_ids.get(pgn, 0) + count
+            return msg_log
+
+        def known_pgns(self) -> set[int]:
+            return set(self._pgn_table.keys())
+
+        def lookup(self, pgn: int):
+            """
+            same as get, but doesn't count unknown IDs
+            """
+            return self._pgn_table.get(pgn)
+
+    class FrameBuffer:
+        """
+        growable columnar storage of frames: timestamps, payload matrix and payload length.
+        Frames are sorted by time on finalize
+        """
+        __slots__ = ('_time', '_data', '_length', '_size', '_runs')
+        # more runs than this are sorted at once instead of merged
+        MAX_MERGE_RUNS = 256
+
+        def __init__(self, capacity: int = 64, width: int = 8):
+            self._time = np.empty(capacity, dtype=np.float64)
+            self._data = np.zeros((capacity, width), dtype=np.uint8)
+            self._length = np.empty(capacity, dtype=np.uint16)
+            self._size = 0
+            # start indices of time sorted runs, None if frames inside a run are not sorted
+            self._runs: list[int] | None = [0]
+
+        def __len__(self):
+            return self._size
+
+        @staticmethod
+        def width_for(length: int) -> int:
+            # classic CAN, CAN FD or multi-packet message
+            if length <= 8:
+                return 8
+            return ((length + 63) // 64) * 64
+
+        def _reserve(self, count: int, width: int):
+            capacity = len(self._time)
+            new_size = self._size + count
+            if new_size <= capacity and width <= self._data.shape[1]:
+                return
+            if new_size > capacity:
+                capacity = max(new_size, 2 * capacity)
+            self._resize(capacity, max(width, self._data.shape[1]))
+
+        def _resize(self, capacity: int, width: int):
+            time = np.empty(capacity, dtype=np.float64)
+            time[:self._size] = self._time[:self._size]
+            data = np.zeros((capacity, width), dtype=np.uint8)
+            data[:self._size, :self._data.shape[1]] = self._data[:self._size]
+            length = np.empty(capacity, dtype=np.uint16)
+            length[:self._size] = self._length[:self._size]
+            self._time, self._data, self._length = time, data, length
+
+        def __track_runs(self, time: np.ndarray):
+            """
+            updates sorted runs with frames added at the end
+            """
+            if self._runs is None:
+                return
+            if np.any(time[1:] < time[:-1]):
+                self._runs = None
+            elif self._size > 0 and time[0] < self._time[self._size - 1]:
+                self._runs.append(self._size)
+
+        def release(self):
+            # memory is freed with the buffer
+            pass
+
+        def extend(self, time: np.ndarray, data: np.ndarray, length: np.ndarray):
+            count = len(time)
+            if count == 0:
+                return
+            width = min(data.shape[1], int(length.max()))
+            self._reserve(count, self.width_for(width))
+            self.__track_runs(time)
+            end = self._size + count
+            self._time[self._size:end] = time
+            self._data[self._size:end, :width] = data[:, :width]
+            self._length[self._size:end] = length
+            self._size = end
+
+        @staticmethod
+        def merge_order(time: np.ndarray, runs: list[int]) -> np.ndarray:
+            """
+            k-way merge of sorted runs, pairwise with binary search
+            :param time: timestamps
+            :param runs: start indices of sorted runs
+            :return: stable order of frames sorting time
+            """
+            bounds = runs + [len(time)]
+            parts = [np.arange(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+            while len(parts) > 1:
+                merged = []
+                for a, b in zip(parts[0::2], parts[1::2]):
+                    # place of each b frame after equal a frames
+                    b_pos = np.searchsorted(time[a], time[b], side='right') + np.arange(len(b))
+                    out = np.empty(len(a) + len(b), dtype=np.int64)
+                    is_b = np.zeros(len(out), dtype=bool)
+                    is_b[b_pos] = True
+                    out[b_pos] = b
+                    out[~is_b] = a
+                    merged.append(out)
+                if len(parts) % 2 == 1:
+                    merged.append(parts[-1])
+                parts = merged
+            return parts[0]
+
+        def _sort(self):
+            """
+            sorts frames by time
+            """
+            if self._runs is not None and len(self._runs) == 1:
+                return
+            time = self.time
+            if self._runs is None or len(self._runs) > self.MAX_MERGE_RUNS:
+                order = np.argsort(time, kind='stable')
+            else:
+                order = self.merge_order(time, self._runs)
+            self._reorder(order)
+            self._runs = [0]
+
+        def _reorder(self, order: np.ndarray):
+            self._time[:self._size] = self._time[:self._size][order]
+            self._data[:self._size] = self._data[:self._size][order]
+            self._length[:self._size] = self._length[:self._size][order]
+
+        def finalize(self):
+            self._sort()
+            # release unused capacity
+            if len(self._time) != self._size:
+                self._time = self._time[:self._size].copy()
+                self._data = self._data[:self._size].copy()
+                self._length = self._length[:self._size].copy()
+
+        @property
+        def time(self) -> np.ndarray:
+            return self._time[:self._size]
+
+        @property
+        def data(self) -> np.ndarray:
+            return self._data[:self._size]
+
+        @property
+        def length(self) -> np.ndarray:
+            return self._length[:self._size]
+
+    class MappedFrameBuffer(FrameBuffer):
+        """
+        FrameBuffer with columns in memory mapped files, for logs larger than RAM
+        """
+        __slots__ = ('_path',)
+
+        def __init__(self, path: Path, capacity: int = 64, width: int = 8):
+            self._path = path
+            self._size = 0
+            self._runs = [0]
+            self._map(max(capacity, 1), width)
+
+        def __file(self, column: str) -> Path:
+            return self._path.with_name(f'{self._path.name}.{column}')
+
+        def __open(self, column: str, dtype, shape: tuple) -> np.memmap:
+            # grow or shrink file in place, written frames are kept
+            fp = self.__file(column)
+            with fp.open('ab') as f:
+                f.truncate(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            return np.memmap(fp, dtype=dtype, mode='r+', shape=shape)
+
+        def _map(self, capacity: int, width: int):
+            self._time = self.__open('time', np.float64, (capacity,))
+            self._data = self.__open('data', np.uint8, (capacity, width))
+            self._length = self.__open('length', np.uint16, (capacity,))
+
+        def _resize(self, capacity: int, width: int):
+            old_width = self._data.shape[1]
+            if width != old_width:
+                # rows change their layout, rewrite payload in chunks
+                old_data = self._data
+                new_fp = self.__file('data_new')
+                new_data = np.memmap(new_fp, dtype=np.uint8, mode='w+', shape=(capacity, width))
+                step = max(1, (1 << 24) // width)
+                for start in range(0, self._size, step):
+                    end = min(start + step, self._size)
+                    new_data[start:end, :old_width] = old_data[start:end]
+                new_data.flush()
+                del new_data, old_data
+                self._data = None
+                new_fp.replace(self.__file('data'))
+            self._flush()
+            self._time = self._data = self._length = None
+            self._map(capacity, width)
+
+        def _flush(self):
+            for column in (self._time, self._data, self._length):
+                if column is not None:
+                    column.flush()
+
+        def _reorder(self, order: np.ndarray):
+            # gather into new files in chunks, columns may be larger than RAM
+            capacity = len(self._time)
+            width = self._data.shape[1]
+            columns = (('time', np.float64, (capacity,)), ('data', np.uint8, (capacity, width)),
+                       ('length', np.uint16, (capacity,)))
+            step = max(1, (1 << 24) // width)
+            for column, dtype, shape in columns:
+                old_column = getattr(self, '_' + column)
+                new_fp = self.__file(column + '_new')
+                new_column = np.memmap(new_fp, dtype=dtype, mode='w+', shape=shape)
+                for start in range(0, self._size, step):
+                    end = min(start + step, self._size)
+                    new_column[start:end] = old_column[order[start:end]]
+                new_column.flush()
+                del new_column, old_column
+                setattr(self, '_' + column, None)
+                new_fp.replace(self.__file(column))
+            self._map(capacity, width)
+
+        def release(self):
+            """
+            deletes the backing files, mapped columns stay readable where the OS allows
+            """
+            for column in ('time', 'data', 'length'):
+                try:
+                    self.__file(column).unlink(missing_ok=True)
+                except OSError:
+                    # still mapped on Windows, removed with the storage folder
+                    pass
+
+        def finalize(self):
+            self._sort()
+            # release unused capacity
+            if len(self._time) != self._size:
+                self._resize(max(self._size, 1), self._data.shape[1])
+            self._flush()
+
+    class FrameStorage:
+        """
+        creates frame buffers backed by memory mapped files in a temporary folder
+        """
+        def __init__(self, folder: Path):
+            folder.mkdir(parents=True, exist_ok=True)
+            self._tmp_dir = tempfile.TemporaryDirectory(prefix='mf4reader_', dir=folder)
+            self.folder = Path(self._tmp_dir.name)
+            self._counter = 0
+
+        def new_buffer(self, capacity: int = 64, width: int = 8) -> 'MF4Reader.MappedFrameBuffer':
+            self._counter += 1
+            return MF4Reader.MappedFrameBuffer(self.folder / str(self._counter), capacity=capacity, width=width)
+
+        def close(self):
+            self._tmp_dir.cleanup()
+
     class MsgDestination:
-        def __init__(self, da: int):
+        __slots__ = ('address', '_sources', 'storage')
+
+        def __init__(self, da: int, storage: 'MF4Reader.FrameStorage' = None):
             self.address: int = da
             self._sources: dict[int, MF4Reader.MsgSource] = dict()
+            self.storage = storage
 
-        def add_frame(self, time, data, sa, channel):
+        def add_frames(self, time: np.ndarray, data: np.ndarray, length: np.ndarray, sa: int, channel: int):
             if sa not in self._sources:
-                self._sources[sa] = MF4Reader.MsgSource(sa)
-            self._sources[sa].add_frame(time, data, channel)
+                self._sources[sa] = MF4Reader.MsgSource(sa, self.storage)
+            self._sources[sa].add_frames(time, data, length, channel)
+
+        def finalize(self):
+            for source in self._sources.values():
+                source.finalize()
 
         def has_sa(self, sa: int):
             return sa in self._sources
@@ -460,28 +2220,41 @@ class MF4Reader:
                 # reuse mutable input
                 pass
 
-            if len(self._sources) > 1:
-                if trace_data.SA is None:
-                    sa_key = MF4Reader.TraceData.select_sa(list(self._sources.keys()))
-                    trace_data.SA = sa_key
-                else:
-                    sa_key = trace_data.SA
+            if trace_data.SA is not None:
+                sa_key = trace_data.SA
+            elif len(self._sources) > 1:
+                sa_key = MF4Reader.TraceData.select_sa(list(self._sources.keys()))
+                trace_data.SA = sa_key
             else:
                 sa_key = list(self._sources.keys())[0]
-                trace_data.SA = None
+            if sa_key not in self._sources:
+                return None
             return self._sources[sa_key].get_trace(trace_data=trace_data)
 
     class MsgSource:
-        def __init__(self, sa: int):
+        __slots__ = ('address', 'channels', 'storage')
+
+        def __init__(self, sa: int, storage: 'MF4Reader.FrameStorage' = None):
             self.address: int = sa
 
-            self.channels: dict[int, list] = dict()
+            self.channels: dict[int, MF4Reader.FrameBuffer] = dict()
+            self.storage = storage
+
+        def __new_buffer(self, capacity: int = 64, width: int = 8) -> 'MF4Reader.FrameBuffer':
+            if self.storage is None:
+                return MF4Reader.FrameBuffer(capacity=capacity, width=width)
+            return self.storage.new_buffer(capacity=capacity, width=width)
 
-        def add_frame(self, time: float, data, channel: int):
+        def add_frames(self, time: np.ndarray, data: np.ndarray, length: np.ndarray, channel: int):
             if channel not in self.channels:
-                self.channels[channel] = [(time, data)]
-            else:
-                self.channels[channel].append((time, data))
+                # width of the payload, not of the zero padded chunk
+                width = MF4Reader.FrameBuffer.width_for(int(length.max()) if len(length) else 0)
+                self.channels[channel] = self.__new_buffer(capacity=len(time), width=width)
+            self.channels[channel].extend(time, data, length)
+
+        def finalize(self):
+            for frames in self.channels.values():
+                frames.finalize()
 
         def get_trace(self, trace_data: 'MF4Reader.TraceData' = None) -> 'MF4Reader.TraceData':
             # create output struct
@@ -492,45 +2265,72 @@ class MF4Reader:
                 pass
 
             # select CAN
-            if len(self.channels) > 1:
-                if trace_data.CAN is None:
-                    can_key = MF4Reader.TraceData.select_can(list(self.channels.keys()))
-                    trace_data.CAN = can_key
-                else:
-                    can_key = trace_data.CAN
+            if trace_data.CAN is not None:
+                can_key = trace_data.CAN
+            elif len(self.channels) > 1:
+                can_key = MF4Reader.TraceData.select_can(list(self.channels.keys()))
+                trace_data.CAN = can_key
             else:
                 can_key = list(self.channels.keys())[0]
-                trace_data.CAN = None
-            trace_data.trace = self.channels[can_key]
+            if can_key not in self.channels:
+                return None
+            frames = self.channels[can_key]
+            trace_data.trace = (frames.time, frames.data)
             return trace_data
 
     class MessageLog:
-        def __init__(self, msg_obj):
+        __slots__ = ('msg', '_sources', 'storage')
+
+        def __init__(self, msg_obj, storage: 'MF4Reader.FrameStorage' = None):
             self.msg = msg_obj
+            self.storage = storage
 
             self._sources: dict[int, MF4Reader.MsgSource] = dict()
 
-        def add_frame(self, time: float, data, sa: int, channel):
+        def add_frames(self, time: np.ndarray, data: np.ndarray, length: np.ndarray, sa: int, channel):
             if sa not in self._sources:
-                self._sources[sa] = MF4Reader.MsgSource(sa)
-            self._sources[sa].add_frame(time, data, channel)
+                self._sources[sa] = MF4Reader.MsgSource(sa, self.storage)
+            self._sources[sa].add_frames(time, data, length, channel)
+
+        def finalize(self):
+            for source in self._sources.values():
+                source.finalize()
+
+        def buckets(self):
+            """
+            :return: iterator of (DA, SA, channel, frames). DA is -1
+            """
+            for sa, source in self._sources.items():
+                for channel, frames in source.channels.items():
+                    yield -1, sa, channel, frames
 
         def get_pgn(self):
             return self.msg.pgn
 
+        def release(self):
+            for _, _, _, frames in self.buckets():
+                frames.release()
+
         def has_sa(self, sa: int):
             return sa in self._sources
 
-        def get_frame_trace(self, msg_name: str) -> 'MF4Reader.TraceData | None':
+        def get_frame_trace(self, msg_name: str,
+                            trace_data: 'MF4Reader.TraceData' = None) -> 'MF4Reader.TraceData | None':
+            """
+            :param trace_data: preselected SA and CAN, None fields are asked for if ambiguous
+            """
             if self.msg.name == msg_name:
-                trace_data = MF4Reader.TraceData()
+                if trace_data is None:
+                    trace_data = MF4Reader.TraceData()
                 # select source
-                if len(self._sources) > 1:
+                if trace_data.SA is not None:
+                    sa_key = trace_data.SA
+                elif len(self._sources) > 1:
                     sa_key = MF4Reader.TraceData.select_sa(list(self._sources.keys()))
-                    # trace_data.SA = sa_key
                 else:
                     sa_key = list(self._sources.keys())[0]
-                    # trace_data.SA = None
+                if sa_key not in self._sources:
+                    return None
                 trace_data.SA = sa_key
                 return self._sources[sa_key].get_trace(trace_data=trace_data)
             else:
@@ -540,35 +2340,63 @@ class MF4Reader:
             return len(self._sources) == 0
 
     class MessageLogPdu1:
-        def __init__(self, msg_obj):
+        __slots__ = ('msg', '_destinations', 'storage')
+
+        def __init__(self, msg_obj, storage: 'MF4Reader.FrameStorage' = None):
             self.msg = msg_obj
+            self.storage = storage
             self._destinations: dict[int, 'MF4Reader.MsgDestination'] = dict()
 
-        def add_frame(self, time: float, data, da: int, sa, channel):
+        def add_frames(self, time: np.ndarray, data: np.ndarray, length: np.ndarray, da: int, sa, channel):
             if da not in self._destinations:
-                self._destinations[da] = MF4Reader.MsgDestination(da)
-            self._destinations[da].add_frame(time, data, sa, channel)
+                self._destinations[da] = MF4Reader.MsgDestination(da, self.storage)
+            self._destinations[da].add_frames(time, data, length, sa, channel)
+
+        def finalize(self):
+            for destination in self._destinations.values():
+                destination.finalize()
+
+        def buckets(self):
+            """
+            :return: iterator of (DA, SA, channel, frames)
+            """
+            for da, destination in self._destinations.items():
+                for sa, source in destination._sources.items():
+                    for channel, frames in source.channels.items():
+                        yield da, sa, channel, frames
 
         def get_pgn(self):
             # zero DA
             return self.msg.pgn & 0x1FFF00
 
+        def release(self):
+            for _, _, _, frames in self.buckets():
+                frames.release()
+
         def has_sa(self, sa: int):
             for da in self._destinations:
                 if self._destinations[da].has_sa(sa):
                     return True
             return False
 
-        def get_frame_trace(self, msg_name: str) -> 'MF4Reader.TraceData | None':
+        def get_frame_trace(self, msg_name: str,
+                            trace_data: 'MF4Reader.TraceData' = None) -> 'MF4Reader.TraceData | None':
+            """
+            :param trace_data: preselected DA, SA and CAN, None fields are asked for if ambiguous
+            """
             if self.msg.name == msg_name:
-                trace_data = MF4Reader.TraceData()
-                # select source
-                if len(self._destinations) > 1:
+                if trace_data is None:
+                    trace_data = MF4Reader.TraceData()
+                # select destination
+                if trace_data.DA is not None:
+                    da_key = trace_data.DA
+                elif len(self._destinations) > 1:
                     da_key = MF4Reader.TraceData.select_da(list(self._destinations.keys()))
                     trace_data.DA = da_key
                 else:
                     da_key = list(self._destinations.keys())[0]
-                    trace_data.DA = None
+                if da_key not in self._destinations:
+                    return None
                 return self._destinations[da_key].get_trace(trace_data=trace_data)
             else:
                 return None
@@ -581,6 +2409,10 @@ if __name__ == '__main__':
     aparser = argparse.ArgumentParser(description='This tool can read can log file(s) and plot data using dbc files.')
     aparser.add_argument('-dbc', nargs='?', help='Folder with dbc files')
     aparser.add_argument('-l', '--logs', nargs='?', help='Folder with MF4 log files')
+    aparser.add_argument('--lazy', action='store_true', help='Load MF4 log data on demand')
+    aparser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes parsing dbc and log files')
+    aparser.add_argument('--cache', nargs='?', help='Folder of ingested log files and compiled dbc cache')
+    aparser.add_argument('--storage', nargs='?', help='Keep frames in memory mapped files in this folder')
     args = aparser.parse_args()
 
     if args.logs is None:
@@ -591,7 +2423,13 @@ if __name__ == '__main__':
         args.dbc = input('DBC folder: ')
     args.dbc = Path(args.dbc)
 
-    mReader = MF4Reader(args.logs, args.dbc)
+    if args.cache is not None:
+        args.cache = Path(args.cache)
+    if args.storage is not None:
+        args.storage = Path(args.storage)
+
+    mReader = MF4Reader(args.logs, args.dbc, lazy=args.lazy, workers=args.workers, cache_dir=args.cache,
+                        storage_dir=args.storage)
 
     while True:
         sig_name = input('Signal to add (<Msg.Sig>):')
@@ -0,0 +1,151 @@
+from MF4Reader import MF4Reader
+from dbcparser import Database
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import numpy as np
+
+
+def parse_specs(specs: list[str]) -> dict[str, list[str] | None]:
+    """
+    :param specs: <Msg.Sig> or <Msg> for all signals of the message
+    :return: {message name: signal names, None for all signals}
+    """
+    out: dict[str, list[str] | None] = dict()
+    for spec in specs:
+        msg_name, _, sig_name = spec.strip().partition('.')
+        if msg_name == '':
+            continue
+        if sig_name == '':
+            out[msg_name] = None
+        elif msg_name not in out:
+            out[msg_name] = [sig_name]
+        elif out[msg_name] is not None and sig_name not in out[msg_name]:
+            out[msg_name].append(sig_name)
+    return out
+
+
+def check_specs(database: Database, specs: dict[str, list[str] | None]) -> dict[str, list[str] | None]:
+    """
+    Prints messages and signals missing in the database
+    :return: specs without them
+    """
+    out: dict[str, list[str] | None] = dict()
+    for msg_name, sig_names in specs.items():
+        dbc_msg = database.get_message(msg_name)
+        if dbc_msg is None:
+            print(f'No such message: {msg_name}')
+            continue
+        if sig_names is not None:
+            missing = [name for name in sig_names if dbc_msg.get_signal(name) is None]
+            for name in missing:
+                print(f'No such signal: {msg_name}.{name}')
+            sig_names = [name for name in sig_names if name not in missing]
+            if len(sig_names) == 0:
+                continue
+        out[msg_name] = sig_names
+    return out
+
+
+def export_folder(log_folder: Path, dbc_folder: Path, fmt: str, out_path: Path, msg_names: list[str] = None,
+                  cache_dir: Path = None, lazy: bool = False) -> int:
+    """
+    Ingest one log folder and export all signals, see MF4Reader.export_signals
+    :return: number of exported message traces
+    """
+    reader = MF4Reader(log_folder, dbc_folder, lazy=lazy, cache_dir=cache_dir)
+    try:
+        return reader.export_signals(out_path, fmt, msg_names=msg_names)
+    finally:
+        reader.close()
+
+
+def decode_folder(log_folder: Path, dbc_folder: Path, specs: dict[str, list[str] | None], out_file: Path,
+                  cache_dir: Path = None, lazy: bool = False) -> int:
+    """
+    Ingest one log folder and save decoded signals of all message variants into a compressed npz file.
+    Arrays are named <Msg>(SA:x DA:y CAN:z)/<Sig>, timestamps are <Msg>(SA:x DA:y CAN:z)/time
+    :return: number of decoded message variants
+    """
+    reader = MF4Reader(log_folder, dbc_folder, lazy=lazy, cache_dir=cache_dir)
+    arrays = dict()
+    count = 0
+    try:
+        for msg_name, sig_names in check_specs(reader.database, specs).items():
+            try:
+                decoded = reader.decode_message(msg_name, sig_names)
+            except Exception as ex:
+                print(f'{log_folder}: {ex}')
+                continue
+            if len(decoded) == 0:
+                print(f'{log_folder}: no {msg_name} message in the logs')
+            for trace_data, values in decoded:
+                key = msg_name + trace_data.to_title()
+                arrays[key + '/time'] = trace_data.trace[0]
+                for sig_name in values.dtype.names:
+                    arrays[f'{key}/{sig_name}'] = values[sig_name]
+                count += 1
+    finally:
+        reader.close()
+
+    np.savez_compressed(out_file, **arrays)
+    return count
+
+
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='Decode signals of many log folders without user input.')
+    aparser.add_argument('-dbc', required=True, help='Folder with dbc files')
+    aparser.add_argument('-l', '--logs', nargs='+', required=True, help='Folders with MF4 and BLF log files')
+    aparser.add_argument('-s', '--signals', nargs='*', default=[], help='Signals to decode, <Msg.Sig> or <Msg>')
+    aparser.add_argument('-f', '--signals-file', nargs='?', help='Text file with one <Msg.Sig> per line')
+    aparser.add_argument('-o', '--out', default='.', help='Output folder, one npz file per log folder')
+    aparser.add_argument('-e', '--export', choices=MF4Reader.SignalExport.FORMATS,
+                         help='Export all signals of the given messages, all messages if no signals given')
+    aparser.add_argument('--lazy', action='store_true', help='Load only the requested messages from MF4 files')
+    aparser.add_argument('-w', '--workers', type=int, default=1, help='Number of log folders decoded in parallel')
+    aparser.add_argument('--cache', nargs='?', help='Folder of ingested log files and compiled dbc cache')
+    args = aparser.parse_args()
+
+    sig_specs = list(args.signals)
+    if args.signals_file is not None:
+        with open(args.signals_file, 'r') as f:
+            sig_specs.extend(line for line in f if not line.startswith('#'))
+    sig_specs = parse_specs(sig_specs)
+    if len(sig_specs) == 0 and args.export is None:
+        aparser.error('no signals to decode')
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cache = Path(args.cache) if args.cache is not None else None
+
+    # one output file per log folder, same folder names get a suffix
+    jobs = []
+    names = set()
+    for folder in map(Path, args.logs):
+        name = folder.resolve().name
+        stem, i = name, 1
+        while name in names:
+            name = f'{stem}_{i}'
+            i += 1
+        names.add(name)
+        if args.export is None:
+            jobs.append((folder, out_dir / (name + '.npz')))
+        elif args.export == 'csv':
+            jobs.append((folder, out_dir / name))
+        else:
+            jobs.append((folder, out_dir / (name + '.' + args.export)))
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        if args.export is None:
+            futures = [pool.submit(decode_folder, folder, Path(args.dbc), sig_specs, out_file, cache, args.lazy)
+                       for folder, out_file in jobs]
+        else:
+            msg_names = list(sig_specs.keys()) or None
+            futures = [pool.submit(export_folder, folder, Path(args.dbc), args.export, out_file, msg_names, cache,
+                                   args.lazy)
+                       for folder, out_file in jobs]
+        for (folder, out_file), future in zip(jobs, futures):
+            try:
+                print(f'{folder}: {future.result()} message traces -> {out_file}')
+            except Exception as ex:
+                print(f'{folder}: failed, {ex}')
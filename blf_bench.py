@@ -0,0 +1,92 @@
+from MF4Reader import MF4Reader
+from can.io.blf import BLFReader, BLFWriter
+from can import Message
+from pathlib import Path
+import argparse
+import tempfile
+import time
+import numpy as np
+
+
+def write_log(fp: Path, frames: int, fd_share: float, seed: int = 1):
+    """
+    Write a BLF file of random J1939 frames, fd_share of them CAN FD with 12..64 data bytes
+    """
+    rng = np.random.default_rng(seed)
+    ids = [0x0CF00400, 0x18FEF100, 0x18FECA00, 0x18EF0300, 0x18EB0300, 0x18EC0300]
+    fd_lengths = [12, 16, 20, 24, 32, 48, 64]
+    is_fd = rng.random(frames) < fd_share
+    payload = rng.integers(0, 256, (frames, 64), dtype=np.uint8)
+    # signatures inside payloads, the object scan must skip them
+    payload[::97, 8:12] = np.frombuffer(b'LOBJ', dtype=np.uint8)
+    with BLFWriter(fp) as w:
+        for i in range(frames):
+            size = fd_lengths[i % len(fd_lengths)] if is_fd[i] else i % 9
+            w.on_message_received(Message(timestamp=1000 + i * 1e-4, arbitration_id=ids[i % len(ids)] | (i % 3),
+                                          is_extended_id=True, is_fd=bool(is_fd[i]), channel=i % 2 + 1,
+                                          data=payload[i, :size].tobytes()))
+
+
+def read_reference(fp: Path) -> tuple:
+    """
+    :return: (timestamps, raw IDs, channels, payload bytes) read by python-can
+    """
+    with BLFReader(fp) as log_f:
+        msgs = list(log_f)
+    t = np.array([x.timestamp for x in msgs])
+    raw_ids = np.array([x.arbitration_id | (1 << 31 if x.is_extended_id else 0) for x in msgs], dtype=np.int64)
+    channels = np.array([x.channel for x in msgs], dtype=np.int64)
+    return t, raw_ids, channels, [bytes(x.data) for x in msgs]
+
+
+def read_blocks(fp: Path) -> tuple:
+    """
+    :return: (timestamps, raw IDs, channels, payload bytes) read by BlfBlockReader, in time order
+    """
+    columns = [[], [], [], []]
+    for pgn, da, sa, channel, t, data, length in MF4Reader.BlfBlockReader(fp).buckets(0.0):
+        columns[0].append(t)
+        # PGN has priority, DA is zeroed for PDU1
+        raw_id = ((pgn | max(da, 0)) << 8 | sa) | (1 << 31)
+        columns[1].append(np.full(len(t), raw_id, dtype=np.int64))
+        columns[2].append(np.full(len(t), channel, dtype=np.int64))
+        columns[3].extend(row[:n].tobytes() for row, n in zip(data, length))
+    t = np.concatenate(columns[0])
+    order = np.argsort(t, kind='stable')
+    return (t[order], np.concatenate(columns[1])[order], np.concatenate(columns[2])[order],
+            [columns[3][i] for i in order])
+
+
+def best_time(func, fp: Path, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(fp)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='Check and time BLF reading against python-can.')
+    aparser.add_argument('-n', '--frames', type=int, default=200000, help='Frames per generated log file')
+    aparser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per reader, best time is shown')
+    args = aparser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, fd_share in (('classic', 0.0), ('mixed', 0.1), ('fd heavy', 0.9)):
+            fp = Path(tmp) / f'{name.replace(" ", "_")}.blf'
+            write_log(fp, args.frames, fd_share)
+
+            ref = read_reference(fp)
+            got = read_blocks(fp)
+            same = (len(ref[0]) == len(got[0]) and np.allclose(ref[0], got[0]) and
+                    all(np.array_equal(x, y) for x, y in zip(ref[1:3], got[1:3])) and ref[3] == got[3])
+            failed |= not same
+
+            t_ref = best_time(lambda x: list(BLFReader(x)), fp, args.repeat)
+            t_blocks = best_time(lambda x: list(MF4Reader.BlfBlockReader(x).buckets(0.0)), fp, args.repeat)
+            print(f'{name}: {"ok" if same else "MISMATCH"}, {len(got[0])} frames, python-can {t_ref:.3f}s, '
+                  f'blocks {t_blocks:.3f}s, {t_ref / t_blocks:.1f}x')
+    if failed:
+        raise SystemExit(1)
@@ -1,4 +1,10 @@
 from pathlib import Path
+import hashlib
+import pickle
+import gc
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 
 class Message:
@@ -11,25 +17,65 @@ class Message:
         self.dlc = int(msg_info[3])
 
         self.signals: list[Signal] = []
+        # signal name -> signal, first one wins
+        self._signal_index: dict[str, Signal] = dict()
+        self._decoder: Message.Decoder | None = None
 
         # get pgn
         self.pgn = self.get_pgn(self.id)[0]
 
     def __str__(self):
-        out = f'{Database.KW_OBJ} {self.id} {self.name}: {self.dlc} {Database.KW_DUMMY}'
-        for sig in self.signals:
-            out += f'\n {sig}'
-        out += '\n'
-        return out
+        lines = [f'{Database.KW_OBJ} {self.id} {self.name}: {self.dlc} {Database.KW_DUMMY}']
+        lines.extend(f' {sig}' for sig in self.signals)
+        return '\n'.join(lines) + '\n'
 
     def add_sig(self, signal):
         self.signals.append(signal)
+        self._signal_index.setdefault(signal.name, signal)
+        # layout has changed
+        self._decoder = None
+
+    def compile(self):
+        """
+        precomputes decoder of all message signals
+        """
+        self._decoder = Message.Decoder(self.signals)
+
+    def frames2data(self, frames: np.ndarray) -> np.ndarray:
+        """
+        converts raw message frames into values of all signals
+        :param frames: N x DLC matrix of uint8
+        :return: record array of N rows with float64 field per signal. Multiplexed signals are NaN
+            where multiplexer value doesn't match
+        """
+        if self._decoder is None:
+            self.compile()
+        return self._decoder.decode(frames)
 
     def get_signal(self, sig_name) -> 'Signal':
+        return self._signal_index.get(sig_name)
+
+    def conflicts(self, other: 'Message') -> list[str]:
+        """
+        :return: differences with other definition of the message, empty if both are the same
+        """
+        out = []
+        if self.id != other.id:
+            out.append(f'ID {self.id} != {other.id}')
+        if self.name != other.name:
+            out.append(f'name {self.name} != {other.name}')
+        if self.dlc != other.dlc:
+            out.append(f'DLC {self.dlc} != {other.dlc}')
         for sig in self.signals:
-            if sig.name == sig_name:
-                return sig
-        return None
+            other_sig = other.get_signal(sig.name)
+            if other_sig is None:
+                out.append(f'signal {sig.name} is missing')
+            elif sig.definition() != other_sig.definition():
+                out.append(f'signal {sig.name} {sig.definition()} != {other_sig.definition()}')
+        for other_sig in other.signals:
+            if self.get_signal(other_sig.name) is None:
+                out.append(f'signal {other_sig.name} is new')
+        return out
 
     @staticmethod
     def is_pdu1(msg_id: int) -> bool:
@@ -54,6 +100,75 @@ class Message:
             pgn = msg_id & 0x1FFFFF
         return pgn, sa
 
+    class Decoder:
+        """
+        decodes all signals of a message in one pass. Signals inside the same 64-bit word
+        share the word load
+        """
+        def __init__(self, signals: list['Signal']):
+            self.dtype = np.dtype([(sig.name, np.float64) for sig in signals])
+            self.signals = signals
+
+            # (word index, is big endian) -> [(signal index, shift)]
+            self.words: dict[tuple[int, bool], list[tuple[int, int]]] = dict()
+            # signals spanning two words
+            self.unaligned: list[int] = []
+            for idx, sig in enumerate(signals):
+                if sig.word_layout is None:
+                    self.unaligned.append(idx)
+                else:
+                    word_idx, shift = sig.word_layout
+                    self.words.setdefault((word_idx, sig.bit_reverse), []).append((idx, shift))
+
+            # multiplexing
+            self.multiplexer: int | None = None
+            self.mux_values: dict[int, int] = dict()
+            for idx, sig in enumerate(signals):
+                if sig.multiplex is None:
+                    continue
+                if sig.multiplex == 'M':
+                    self.multiplexer = idx
+                elif sig.multiplex.startswith('m'):
+                    self.mux_values[idx] = int(sig.multiplex[1:].rstrip('M'))
+
+        def decode(self, frames: np.ndarray) -> np.ndarray:
+            out = np.empty(frames.shape[0], dtype=self.dtype)
+            raw: list[np.ndarray | None] = [None] * len(self.signals)
+
+            # pad frames to the whole number of words
+            n_words = (frames.shape[1] + 7) // 8
+            if frames.shape[1] != n_words * 8:
+                padded = np.zeros((frames.shape[0], n_words * 8), dtype=np.uint8)
+                padded[:, :frames.shape[1]] = frames
+                frames = padded
+
+            for (word_idx, big_endian), word_signals in self.words.items():
+                if word_idx >= n_words:
+                    # beyond frame
+                    word = np.zeros(frames.shape[0], dtype=np.uint64)
+                else:
+                    word = np.ascontiguousarray(frames[:, word_idx * 8:(word_idx + 1) * 8])
+                    word = word.view('>u8' if big_endian else '<u8')[:, 0].astype(np.uint64)
+                for idx, shift in word_signals:
+                    raw[idx] = (word >> np.uint64(shift)) & np.uint64(self.signals[idx].mask)
+            for idx in self.unaligned:
+                raw[idx] = self.signals[idx].frames2raw(frames)
+
+            if self.multiplexer is None:
+                mux_raw = None
+            else:
+                mux_raw = raw[self.multiplexer]
+            for idx, sig in enumerate(self.signals):
+                if mux_raw is not None and idx in self.mux_values:
+                    # decode only rows with matching multiplexer
+                    rows = mux_raw == self.mux_values[idx]
+                    values = np.full(frames.shape[0], np.nan)
+                    values[rows] = sig.raw2data(raw[idx][rows])
+                    out[sig.name] = values
+                else:
+                    out[sig.name] = sig.raw2data(raw[idx])
+            return out
+
 
 class Signal:
     def __init__(self, text_data: str):
@@ -139,6 +254,11 @@ class Signal:
         info = text_data.split('"')
         self.units = info[1]
 
+        # precompute bit layout
+        self.mask = (1 << self.length) - 1
+        self._byte_shifts = self.__get_byte_shifts()
+        self.word_layout = self.__get_word_layout()
+
     def __str__(self):
         if self.multiplex is None:
             mul = ''
@@ -157,6 +277,13 @@ class Signal:
 
         return f'{Database.KW_SIG} {self.name} {mul}: {self.start_bit}|{self.length}@{format} ({self.factor},{self.offset}) [{self.min_val}|{self.max_val}] "{self.units}" {Database.KW_DUMMY}'
 
+    def definition(self) -> tuple:
+        """
+        :return: fields defining how signal is decoded
+        """
+        return (self.multiplex, self.start_bit, self.length, self.bit_signed, self.bit_reverse,
+                self.factor, self.offset)
+
     @ staticmethod
     def __to_number(string):
         if string.find('.') != -1 or string.find('E') != 1 or string.find('e') != 1:
@@ -165,42 +292,66 @@ class Signal:
         else:
             return int(string)
 
+    def __get_byte_shifts(self) -> list[tuple[int, int]]:
+        """
+        :return: list of (byte index, shift) pairs. Raw value is OR of all bytes shifted left
+            by given amount (right, if negative)
+        """
+        if self.bit_reverse:
+            # Motorola: start bit is MSB, bytes go from most to least significant
+            msb_pos = (self.start_bit // 8) * 8 + 7 - self.start_bit % 8
+            lsb_pos = msb_pos + self.length - 1
+            byte_pos = msb_pos // 8
+            byte_pos_end = lsb_pos // 8
+            start_sub_pos = 7 - lsb_pos % 8
+            weights = [(byte_pos_end - i) * 8 for i in range(byte_pos, byte_pos_end + 1)]
+        else:
+            # Intel: start bit is LSB, bytes go from least to most significant
+            byte_pos = self.start_bit // 8
+            byte_pos_end = (self.start_bit + self.length - 1) // 8
+            start_sub_pos = self.start_bit % 8
+            weights = [(i - byte_pos) * 8 for i in range(byte_pos, byte_pos_end + 1)]
+        return [(i, w - start_sub_pos) for i, w in zip(range(byte_pos, byte_pos_end + 1), weights)]
+
+    def __get_word_layout(self) -> tuple[int, int] | None:
+        """
+        :return: (64-bit word index, shift) or None if signal spans two words. Word is little endian
+            for Intel and big endian for Motorola
+        """
+        if self.bit_reverse:
+            msb_pos = (self.start_bit // 8) * 8 + 7 - self.start_bit % 8
+            lsb_pos = msb_pos + self.length - 1
+            word_idx = msb_pos // 64
+            if lsb_pos // 64 != word_idx:
+                return None
+            return word_idx, 63 - (lsb_pos - word_idx * 64)
+        else:
+            word_idx = self.start_bit // 64
+            if (self.start_bit + self.length - 1) // 64 != word_idx:
+                return None
+            return word_idx, self.start_bit - word_idx * 64
+
     def bytes2data(self, raw_value: list):
         """
         converst raw message frame into signal value
         :param raw_value: list of uint8
         :return:
         """
-        # assume that list goes from 0 to N and
-
-        # extract
-        byte_pos = self.start_bit // 8
-        start_sub_pos = self.start_bit % 8
-        byte_pos_end = (self.start_bit + self.length - 1) // 8
-        raw_value = raw_value[byte_pos:byte_pos_end + 1]
-        if self.bit_reverse:
-            # reverse bit order
-            # TODO reverse by bytes or bits??? are they already revresed??
-            byte_order = 'big'
-            raise Exception('Motorola is unsupported')
-        else:
-            byte_order = 'little'
-        # note: handle sign later
-        value = int.from_bytes(raw_value, byteorder=byte_order, signed=False)
-        value = value >> start_sub_pos
-        mask = 0
-        for i in range(self.length):
-            mask = (mask << 1) + 1
-        value = value & mask
+        value = 0
+        for byte_idx, shift in self._byte_shifts:
+            if byte_idx >= len(raw_value):
+                # short frame
+                break
+            byte = int(raw_value[byte_idx])
+            if shift >= 0:
+                value |= byte << shift
+            else:
+                value |= byte >> -shift
+        value = value & self.mask
 
-        if self.bit_signed:
-            # -1 * MSB + rest
-            msb = (1 << self.length) & value
-            value = value & (mask >> 1)
-            value = -1*msb + value
-        else:
-            # get as is
-            pass
+        if self.bit_signed and value >> (self.length - 1):
+            # two's complement
+            value -= 1 << self.length
 
         # offsets and factor
         value *= self.factor
@@ -208,6 +359,47 @@ class Signal:
 
         return value
 
+    def frames2data(self, frames: np.ndarray) -> np.ndarray:
+        """
+        converts raw message frames into signal values
+        :param frames: N x DLC matrix of uint8
+        :return: float64 array of N values
+        """
+        return self.raw2data(self.frames2raw(frames))
+
+    def raw2data(self, value: np.ndarray) -> np.ndarray:
+        """
+        converts raw signal bits into physical values
+        :param value: uint64 array of raw values
+        :return: float64 array
+        """
+        if self.bit_signed:
+            # two's complement
+            value = value.view(np.int64)
+            if self.length < 64:
+                value = value - ((value >> (self.length - 1)) << self.length)
+
+        # offsets and factor
+        return value * self.factor + self.offset
+
+    def frames2raw(self, frames: np.ndarray) -> np.ndarray:
+        """
+        extracts raw (unsigned, unscaled) signal bits from message frames
+        :param frames: N x DLC matrix of uint8
+        :return: uint64 array of N values
+        """
+        value = np.zeros(frames.shape[0], dtype=np.uint64)
+        for byte_idx, shift in self._byte_shifts:
+            if byte_idx >= frames.shape[1]:
+                # short frames
+                break
+            byte = frames[:, byte_idx].astype(np.uint64)
+            if shift >= 0:
+                value |= byte << np.uint64(shift)
+            else:
+                value |= byte >> np.uint64(-shift)
+        return value & np.uint64(self.mask)
+
 
 class ValueTable:
     def __init__(self, raw_text):
@@ -238,62 +430,59 @@ class ValueTable:
 
             self.table[table_val] = table_name
 
+    def __str__(self):
+        values = ''.join(f'{k} "{v}" ' for k, v in self.table.items())
+        return f'{Database.KW_SIG_VAL_TABLE}{self.msg_id} {self.signal_name} {values};'
+
 
 class _Parser:
+    """
+    streams logical statements of DBC file: stripped lines with multi-line string values joined
+    """
     def __init__(self, file):
-        p = Path(file)
-        with p.open('rb') as f:
-            raw_data = f.read()
-            try:
-                self.lines = raw_data.decode('utf-8')
-            except UnicodeDecodeError:
-                self.lines = raw_data.decode('ansi')
-
-            self.lines = self.lines.split('\n')
-
-            # cleanup
-            max_len = len(self.lines)
-            for i in range(max_len):
-                self.lines[i] = self.lines[i].replace('\t', ' ').strip()
-
-            # join string values
-            i = 0
-            while i < max_len:
-                if self.__is_odd(self.lines[i].count('"')):
-                    # has unclosed string value
-                    j = i + 1
-                    while j < max_len:
-                        self.lines[i] += self.lines[j]
-                        if self.__is_odd(self.lines[j].count('"')):
-                            # found the end of string
-                            break
-                        j += 1
-
-                    # remove merged lines
-                    while j - i > 0:
-                        del self.lines[j]
-                        j -= 1
-                        max_len -= 1
-                i += 1
-
-            # remove empty lines
-            #self.lines = [x for x in self.lines if len(x) > 0]
-        self.index = 0
-        self.length = len(self.lines)
+        self.__statements = self.__read(Path(file))
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self.index == self.length:
-            raise StopIteration
+        return next(self.__statements)
 
-        out = self.lines[self.index]
-        self.index += 1
-        return out
+    @staticmethod
+    def __decode(raw_line: bytes) -> str:
+        try:
+            return raw_line.decode('utf-8')
+        except UnicodeDecodeError:
+            return raw_line.decode('ansi')
 
-    def __getitem__(self, item):
-        return self.lines[item]
+    @staticmethod
+    def __read(p: Path):
+        with p.open('rb') as f:
+            # parts of statement with unclosed string value
+            pending = None
+            # empty last line after the final line break, same as in str.split
+            raw_line = b'\n'
+            for raw_line in f:
+                line = _Parser.__decode(raw_line).replace('\t', ' ').strip()
+                is_odd = _Parser.__is_odd(line.count('"'))
+                if pending is not None:
+                    pending.append(line)
+                    if is_odd:
+                        # found the end of string
+                        yield ''.join(pending)
+                        pending = None
+                elif is_odd:
+                    # has unclosed string value
+                    pending = [line]
+                else:
+                    yield line
+            if raw_line.endswith(b'\n'):
+                if pending is None:
+                    yield ''
+                else:
+                    pending.append('')
+            if pending is not None:
+                yield ''.join(pending)
 
     @staticmethod
     def __is_odd(val) -> bool:
@@ -315,9 +504,19 @@ class Database:
     KW_ATTR_DEF_VAL = 'BA_DEF_DEF_ '
     KW_ATTR_VAL = 'BA_ '
     KW_SIG_VAL_TABLE = 'VAL_ '
+    ATTR_CYCLE_TIME = 'GenMsgCycleTime'
+    # bump when layout of pickled database changes
+    CACHE_VERSION = 5
+    # characters per write
+    WRITE_CHUNK = 1 << 20
 
     def __init__(self, file):
         self.version = None
+        # hash of source files, set by from_files
+        self.source_hash = None
+        self.files = [Path(file)]
+        # duplicates and conflicts found by merge
+        self.merge_issues: list[str] = []
         self.net_nodes = None
         self.messages: list[Message] = []
         self.name_space = Database.NameSpace()
@@ -327,6 +526,12 @@ class Database:
         self.defines = []
         self.etc = []
 
+        # indexes, first entry wins same as in linear search
+        self._msg_by_name: dict[str, Message] = dict()
+        self._msg_by_id: dict[int, Message] = dict()
+        self._msgs_by_pgn: dict[int, list[Message]] = dict()
+        self._attr_by_name: dict[str, Database.Attribute] = dict()
+
         parser = _Parser(file)
         for line in parser:
             if line.startswith(Database.KW_NAME_SPACE):
@@ -356,144 +561,349 @@ class Database:
                     if len(n_line) == 0:
                         break
                     msg.add_sig(Signal(n_line))
+                msg.compile()
 
                 if msg.name == self.MSG_UNUSED:
                     if self.unused_sig_msg is not None:
                         raise Exception('Multiple unused signals messages in ' + str(file))
                     self.unused_sig_msg = msg
                 else:
-                    self.messages.append(msg)
+                    self.__add_message(msg)
             elif line.startswith(Database.KW_COMMENT):
                 self.comments.append(line)
             elif line.startswith(Database.KW_ATTR_DEFINE):
-                self.defines.append(Database.Attribute(text_line=line[len(Database.KW_ATTR_DEFINE):]))
+                self.__add_define(Database.Attribute(text_line=line[len(Database.KW_ATTR_DEFINE):]))
             elif line.startswith(Database.KW_ATTR_DEF_VAL):
                 def_val = Database.Attribute.DefaultValue(line[len(Database.KW_ATTR_DEF_VAL):])
                 # find owner
-                for attr in self.defines:
-                    if attr.name == def_val.owner:
-                        attr.set_default_value(def_val)
-                        break
+                attr = self.get_attribute(def_val.owner)
+                if attr is not None:
+                    attr.set_default_value(def_val)
             elif line.startswith(Database.KW_ATTR_VAL):
                 val_setter = Database.Attribute.ValueSetter(line[len(Database.KW_ATTR_VAL):])
                 # find owner
-                for attr in self.defines:
-                    if attr.name == val_setter.owner:
-                        attr.add_value(val_setter)
-                        break
+                attr = self.get_attribute(val_setter.owner)
+                if attr is not None:
+                    attr.add_value(val_setter)
             elif line.startswith(Database.KW_SIG_VAL_TABLE):
-                def __apply_vt_sig(message, vt) -> bool:
-                    for sig in message.signals:
-                        if sig.name == vt.signal_name:
-                            sig.value_table = vt
-                            return True
-                    else:
-                        return False
-
                 vt_sig = ValueTable(line[len(Database.KW_SIG_VAL_TABLE):])
-                for msg in self.messages:
-                    if msg.id == vt_sig.msg_id:
-                        if not __apply_vt_sig(msg, vt_sig):
-                            raise Exception(f"Can't find signal for value table: {line}")
-                        break
-                else:
-                    if self.unused_sig_msg is not None and self.unused_sig_msg.id == vt_sig.msg_id:
-                        if not __apply_vt_sig(self.unused_sig_msg, vt_sig):
-                            raise Exception(f"Can't find signal for value table: {line}")
-                    else:
-                        raise Exception(f"Can't find message for value table: {line}")
-                self.etc.append(line)
+                msg = self._msg_by_id.get(vt_sig.msg_id)
+                if msg is None and self.unused_sig_msg is not None and self.unused_sig_msg.id == vt_sig.msg_id:
+                    msg = self.unused_sig_msg
+                if msg is None:
+                    raise Exception(f"Can't find message for value table: {line}")
+                sig = msg.get_signal(vt_sig.signal_name)
+                if sig is None:
+                    raise Exception(f"Can't find signal for value table: {line}")
+                sig.value_table = vt_sig
             else:
                 if len(line) > 0:
                     self.etc.append(line)
 
     def __str__(self):
-        out = f'{Database.KW_VERSION} {self.version}\n\n'
-        out += f'{self.name_space}\n'
+        return ''.join(self.__chunks())
+
+    def __chunks(self):
+        """
+        :return: iterator of dbc file text pieces, in order
+        """
+        if self.version is None:
+            yield f'{Database.KW_VERSION}""\n\n'
+        else:
+            yield f'{Database.KW_VERSION}{self.version}\n\n'
+        yield f'{self.name_space}\n'
 
         # legacy
-        out += f'{Database.KW_BAUDRATE}:\n'
+        yield f'{Database.KW_BAUDRATE}:\n'
 
         # nodes
-        out += f'{self.net_nodes}\n'
+        if self.net_nodes is None:
+            yield f'{Database.KW_NODES}:\n'
+        else:
+            yield f'{self.net_nodes}\n'
 
         # unused tables
-        out += '\n'.join(self.unused_val_tables) + '\n\n'
+        yield '\n'.join(self.unused_val_tables) + '\n\n'
 
         # messages
         if self.unused_sig_msg is not None:
-            out += str(self.unused_sig_msg) + '\n\n'
-        out += '\n\n'.join((str(x) for x in self.messages)) + '\n\n'
+            yield str(self.unused_sig_msg) + '\n\n'
+        for i, msg in enumerate(self.messages):
+            if i > 0:
+                yield '\n\n'
+            yield str(msg)
+        yield '\n\n'
 
         # comments
         for comm in self.comments:
-            out += comm + '\n'
+            yield comm + '\n'
 
         # defines
         for define in self.defines:
-            out += str(define) + '\n'
+            yield str(define) + '\n'
         for define in self.defines:
-            out += str(define.default_val) + '\n'
+            if define.default_val is not None:
+                yield str(define.default_val) + '\n'
         for define in self.defines:
             for val in define.value_setters:
-                out += str(val) + '\n'
+                yield str(val) + '\n'
 
-        # TODO value tables
+        # value tables
+        if self.unused_sig_msg is not None:
+            messages = [self.unused_sig_msg] + self.messages
+        else:
+            messages = self.messages
+        for msg in messages:
+            for sig in msg.signals:
+                if sig.value_table is not None:
+                    yield str(sig.value_table) + '\n'
 
         # etc
-        out += '\n'.join(self.etc)
+        for i, line in enumerate(self.etc):
+            if i > 0:
+                yield '\n'
+            yield line
 
-        return out
+    @staticmethod
+    def hash_files(files: list) -> str:
+        """
+        :return: hash of names and contents of given files, independent of their order
+        """
+        h = hashlib.sha1()
+        for fp in sorted(Path(x) for x in files):
+            h.update(fp.name.encode('utf-8'))
+            h.update(fp.read_bytes())
+        return h.hexdigest()
+
+    @staticmethod
+    def from_files(files: list, cache_dir: Path = None, workers: int = 1) -> 'Database':
+        """
+        parses and merges dbc files. Merged database with precompiled decoders is pickled in cache_dir,
+        keyed by hash of source files
+        :param files: dbc files, merged in order of names
+        :param cache_dir: folder of compiled databases, None to disable
+        :param workers: number of processes parsing files in parallel
+        :return: merged database
+        """
+        files = sorted(Path(x) for x in files)
+        if len(files) == 0:
+            raise Exception('No dbc files to parse')
+        source_hash = Database.hash_files(files)
+
+        # lots of small objects, don't let gc scan them while loading
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return Database.__load_files(files, source_hash, cache_dir, workers)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    @staticmethod
+    def __load_files(files: list[Path], source_hash: str, cache_dir: Path | None, workers: int) -> 'Database':
+        if cache_dir is not None:
+            cache_file = cache_dir / f'{source_hash}.v{Database.CACHE_VERSION}.pickle'
+            try:
+                with cache_file.open('rb') as f:
+                    return pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+                # not cached or stale
+                pass
+
+        if workers > 1 and len(files) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                databases = list(pool.map(Database, files))
+        else:
+            databases = (Database(fp) for fp in files)
+
+        database = None
+        for other_database in databases:
+            if database is None:
+                database = other_database
+            else:
+                database.merge(other_database)
+        database.source_hash = source_hash
+
+        if cache_dir is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            # per process, parallel readers may compile the same files at once
+            tmp_file = cache_file.with_name(f'{cache_file.name}.{os.getpid()}.tmp')
+            with tmp_file.open('wb') as f:
+                pickle.dump(database, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_file.replace(cache_file)
+        return database
+
+    def write(self, f):
+        """
+        streams dbc text into file object
+        :param f: text file object
+        """
+        # join small pieces into chunks, one write per chunk
+        chunk = []
+        chunk_len = 0
+        for text in self.__chunks():
+            chunk.append(text)
+            chunk_len += len(text)
+            if chunk_len >= Database.WRITE_CHUNK:
+                f.write(''.join(chunk))
+                chunk = []
+                chunk_len = 0
+        f.write(''.join(chunk))
 
     def to_file(self, path):
-        str_out = str(self).encode('utf-8')
-        with path.open('wb') as f:
-            f.write(str_out)
+        with path.open('w', encoding='utf-8', newline='\n') as f:
+            self.write(f)
+
+    def __add_message(self, msg: Message):
+        self.messages.append(msg)
+        self._msg_by_name.setdefault(msg.name, msg)
+        self._msg_by_id.setdefault(msg.id, msg)
+        self._msgs_by_pgn.setdefault(msg.pgn, []).append(msg)
+
+    def __add_define(self, attr: 'Database.Attribute'):
+        self.defines.append(attr)
+        self._attr_by_name.setdefault(attr.name, attr)
 
     def get_attribute(self, name):
-        for a in self.defines:
-            if a.name == name:
-                return a
-        return None
+        return self._attr_by_name.get(name)
+
+    def get_cycle_time(self, msg: Message) -> float | None:
+        """
+        :return: GenMsgCycleTime of message in ms, None if not set or not cyclic
+        """
+        attr = self.get_attribute(Database.ATTR_CYCLE_TIME)
+        if attr is None:
+            return None
+        value = attr.get_message_value(msg.id)
+        if value is None:
+            return None
+        try:
+            value = float(value.strip('"'))
+        except ValueError:
+            return None
+        return value if value > 0 else None
 
     def get_message(self, msg_name):
-        for m in self.messages:
-            if m.name == msg_name:
-                return m
-        return None
+        return self._msg_by_name.get(msg_name)
+
+    def get_message_by_id(self, msg_id: int) -> Message | None:
+        return self._msg_by_id.get(msg_id)
+
+    def get_messages_by_pgn(self, pgn: int) -> list[Message]:
+        """
+        :return: messages with given PGN, in order of definition
+        """
+        return self._msgs_by_pgn.get(pgn, [])
+
+    def get_signal(self, msg_name, sig_name) -> Signal | None:
+        msg = self.get_message(msg_name)
+        if msg is None:
+            return None
+        return msg.get_signal(sig_name)
 
     def add_attribute(self, name, val_type, value):
         a_val = Database.Attribute(name=name, val_type=val_type)
         def_val = Database.Attribute.DefaultValue(owner=name, value=value)
         a_val.set_default_value(def_val)
-        self.defines.append(a_val)
+        self.__add_define(a_val)
+
+    @staticmethod
+    def __comment_key(comment: str) -> tuple:
+        """
+        :return: tokens before the comment text, e.g. (SG_, message ID, signal name), empty for database comment
+        """
+        return tuple(comment.partition('"')[0].split()[1:])
+
+    def __merge_issue(self, issue: str):
+        print('DBC merge: ' + issue)
+        self.merge_issues.append(issue)
 
     def merge(self, other_database: 'Database'):
+        """
+        adds messages and attributes of other database. Duplicates are skipped, conflicting definitions
+        are reported and the first one is kept. Comments, value tables and other lines are skipped the
+        same way, keyed by the object they describe
+        """
         # TODO ?
         # self.net_nodes = None
+        source = ', '.join(str(x) for x in other_database.files)
 
         self.name_space.merge(other_database.name_space)
 
-        self.messages += other_database.messages
-        self.unused_val_tables += other_database.unused_val_tables
-        self.comments += other_database.comments
-        self.defines += other_database.defines
-        self.etc += other_database.etc
-
-        if self.unused_sig_msg is not None:
-            if other_database.unused_sig_msg is None:
-                # leave self as is
-                pass
-            else:
-                # merge
-                self.unused_sig_msg.signals += other_database.unused_sig_msg.signals
-        elif other_database.unused_sig_msg is not None:
-            if self.unused_sig_msg is None:
-                # just copy(?)
-                self.unused_sig_msg = other_database.unused_sig_msg
+        # IDs as in dbc lines, other lines of these messages are skipped
+        conflicting_ids = set()
+        for msg in other_database.messages:
+            known_msg = self._msg_by_id.get(msg.id)
+            if known_msg is None:
+                known_msg = self._msg_by_name.get(msg.name)
+            if known_msg is None:
+                self.__add_message(msg)
+                continue
+
+            conflicts = known_msg.conflicts(msg)
+            if len(conflicts) == 0:
+                self.__merge_issue(f'duplicate message {msg.name} ({msg.id}) in {source}')
             else:
-                # merge
-                self.unused_sig_msg.signals += other_database.unused_sig_msg.signals
+                conflicting_ids.add(str(msg.id))
+                self.__merge_issue(f'conflicting message {msg.name} ({msg.id}) in {source}, kept '
+                                   f'{known_msg.name} ({known_msg.id}): ' + '; '.join(conflicts))
+
+        # by table name
+        known_tables = {x.split()[1] for x in self.unused_val_tables}
+        for val_table in other_database.unused_val_tables:
+            name = val_table.split()[1]
+            if name not in known_tables:
+                known_tables.add(name)
+                self.unused_val_tables.append(val_table)
+        # by described object, first one wins
+        known_comments = {self.__comment_key(x) for x in self.comments}
+        for comm in other_database.comments:
+            key = self.__comment_key(comm)
+            if key in known_comments:
+                continue
+            if len(key) > 1 and key[0] in (Database.KW_OBJ, Database.KW_SIG) and key[1] in conflicting_ids:
+                continue
+            known_comments.add(key)
+            self.comments.append(comm)
+        for attr in other_database.defines:
+            known_attr = self._attr_by_name.get(attr.name)
+            if known_attr is None:
+                self.__add_define(attr)
+                continue
+
+            if (known_attr.owner_type, known_attr.value_type) != (attr.owner_type, attr.value_type):
+                self.__merge_issue(f'conflicting attribute {attr.name} in {source}: '
+                                   f'{known_attr.value_type} != {attr.value_type}')
+            # values are set per message, skip repeated ones
+            for val_setter in attr.value_setters:
+                if not known_attr.has_value(val_setter):
+                    known_attr.add_value(val_setter)
+        # by whole line, or message ID after the keyword
+        known_etc = set(self.etc)
+        for line in other_database.etc:
+            tokens = line.split()
+            if line in known_etc or (len(tokens) > 1 and tokens[1] in conflicting_ids):
+                continue
+            known_etc.add(line)
+            self.etc.append(line)
+
+        if other_database.unused_sig_msg is None:
+            # leave self as is
+            pass
+        elif self.unused_sig_msg is None:
+            # just copy(?)
+            self.unused_sig_msg = other_database.unused_sig_msg
+        else:
+            # merge
+            for sig in other_database.unused_sig_msg.signals:
+                known_sig = self.unused_sig_msg.get_signal(sig.name)
+                if known_sig is None:
+                    self.unused_sig_msg.add_sig(sig)
+                elif known_sig.definition() != sig.definition():
+                    self.__merge_issue(f'conflicting unused signal {sig.name} in {source}')
+
+        self.files += other_database.files
+        self.merge_issues += other_database.merge_issues
 
     class NameSpace:
         def __init__(self):
@@ -548,6 +958,10 @@ class Database:
             # will be inited later
             self.default_val = None
             self.value_setters = []
+            # (owner, value) of all setters
+            self._value_keys = set()
+            # message ID -> value, first one wins
+            self._msg_values: dict[int, str] = dict()
 
         def __str__(self):
             if self.owner_type is None:
@@ -564,6 +978,24 @@ class Database:
 
         def add_value(self, val_setter):
             self.value_setters.append(val_setter)
+            self._value_keys.add((val_setter.owner, val_setter.value))
+            if val_setter.value.startswith(Database.KW_OBJ + ' '):
+                # BO_ <message ID> <value>
+                parts = val_setter.value.split(maxsplit=2)
+                if len(parts) == 3:
+                    self._msg_values.setdefault(int(parts[1]), parts[2])
+
+        def get_message_value(self, msg_id: int) -> str | None:
+            """
+            :return: raw value text set for message, default value if not set, or None
+            """
+            value = self._msg_values.get(msg_id)
+            if value is None and self.default_val is not None:
+                value = self.default_val.value
+            return value
+
+        def has_value(self, val_setter) -> bool:
+            return (val_setter.owner, val_setter.value) in self._value_keys
 
         def to_string_default_val(self):
             return str(self.default_val)
@@ -6,6 +6,7 @@ import argparse
 aparser = argparse.ArgumentParser(description='List all messages from a given source.')
 aparser.add_argument('-dbc', nargs='?', help='Folder with dbc files')
 aparser.add_argument('-l', '--logs', nargs='?', help='Folder with MF4 log files')
+aparser.add_argument('--cache', nargs='?', help='Folder of ingested log files and compiled dbc cache')
 args = aparser.parse_args()
 
 if args.logs is None:
@@ -16,8 +17,11 @@ if args.dbc is None:
     args.dbc = input('DBC folder: ')
 args.dbc = Path(args.dbc)
 
+if args.cache is not None:
+    args.cache = Path(args.cache)
 
-mReader = MF4Reader(args.logs, args.dbc)
+
+mReader = MF4Reader(args.logs, args.dbc, cache_dir=args.cache)
 
 while True:
     sa = input('SA: ')